@@ -1 +1,10 @@
 SET(BAREIO_ARCH_SOURCES "start.S" "system.c")
+
+# With 4-byte words, build for the ILP32 ABI, where pointers and `ptrdiff_t` are 32 bits wide.
+IF(BAREIO_WORD_SIZE EQUAL 4)
+	STRING(APPEND CMAKE_C_FLAGS " -mabi=ilp32")
+	STRING(APPEND CMAKE_ASM_FLAGS " -mabi=ilp32")
+	SET(BAREIO_ARCH_LINK_FLAGS "-m aarch64elf32")
+ELSEIF(NOT BAREIO_WORD_SIZE EQUAL 8)
+	MESSAGE(FATAL_ERROR "BAREIO_WORD_SIZE must be 4 or 8 for aarch64, not ${BAREIO_WORD_SIZE}")
+ENDIF()
@@ -6,15 +6,25 @@
 
 typedef struct _BareioObject BareioObject;
 typedef struct _BareioArguments BareioArguments;
+typedef struct _BareioMessage BareioMessage;
 
-typedef struct {
+typedef BareioObject* (BareioBuiltinMessageFunc)(BareioObject *self, BareioMessage *message, BareioObject *locals);
+typedef BareioBuiltinMessageFunc* (BareioBuiltinLookupFunc)(ptrdiff_t name_offset);
+
+struct _BareioMessage {
 	ptrdiff_t name_offset;
 	BareioObject *forced_result;
 	BareioArguments *arguments;
-} BareioMessage;
 
-typedef BareioObject* (BareioBuiltinMessageFunc)(BareioObject *self, BareioMessage *message, BareioObject *locals);
-typedef BareioBuiltinMessageFunc* (BareioBuiltinLookupFunc)(ptrdiff_t name_offset);
+	// Set by the compiler when the receiver's type is known, to skip the lookup.
+	BareioBuiltinMessageFunc *resolved;
+
+#ifdef BAREIO_PROFILE
+	// Times the message has run, dumped on halt. A word like every other field, so that messages stay
+	// a whole number of words whatever the word size.
+	uintptr_t count;
+#endif
+};
 
 typedef struct {
 	void *dummy;
@@ -31,10 +41,20 @@ struct _BareioObject {
 
 	union {
 		BareioString *data_string;
-		int64_t data_integer;
+		intptr_t data_integer;
 	};
 };
 
+// Integers that fit in a word less a bit are immediate: the object reference holds the integer,
+// shifted left by one and with this bit set, instead of pointing at an object. Use
+// `bareio_object_lookup` and `bareio_integer_value` on references that may be immediate.
+#define BAREIO_INTEGER_TAG ((uintptr_t) 1)
+
+// Arguments that are a single literal are stored as a pointer to the literal's object with this bit
+// set (or, for an immediate integer, as the integer itself), rather than as a script that evaluates
+// to it. Use `bareio_evaluate_argument` to read them.
+#define BAREIO_ARGUMENT_LITERAL ((uintptr_t) 2)
+
 struct _BareioArguments {
 	ptrdiff_t len;
 	BareioScript *members[];
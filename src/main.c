@@ -10,8 +10,73 @@
 #include "bio-types.h"
 
 BareioObject* bareio_run_in_context(BareioScript *script, BareioObject *context);
+BareioObject* bareio_evaluate_argument(BareioMessage *message, ptrdiff_t i, BareioObject *locals);
+
+extern BareioBuiltinLookupFunc _bareio_builtin_integer_lookup;
+
+static inline bool bareio_is_immediate(BareioObject *object) {
+	return (uintptr_t) object & BAREIO_INTEGER_TAG;
+}
+
+static inline BareioBuiltinLookupFunc* bareio_object_lookup(BareioObject *object) {
+	return bareio_is_immediate(object) ? _bareio_builtin_integer_lookup : object->builtin_lookup;
+}
+
+static inline int64_t bareio_integer_value(BareioObject *object) {
+	if (bareio_is_immediate(object)) {
+		return (intptr_t) object >> 1;
+	}
+
+	return object->data_integer;
+}
+
+#ifdef BAREIO_PROFILE
+// The messages the compiler gave counters, in the order of its profile map, then NULL.
+extern BareioMessage *const _bareio_profile_messages[];
+
+static void bareio_profile_put_uint(uint64_t i) {
+	char buffer[21];
+	char *pos = buffer + 20;
+	*pos = '\0';
+
+	do {
+		*--pos = '0' + i % 10;
+		i /= 10;
+	} while (i);
+
+	bareio_system_uart_puts(pos);
+}
+
+// Dumps the count of every message that has run, in the format read by stage0/bareio/profile.py.
+void bareio_profile_dump() {
+	size_t n = 0;
+
+	while (_bareio_profile_messages[n]) n++;
+
+	bareio_system_uart_puts("BAREIO-PROFILE-BEGIN ");
+	bareio_profile_put_uint(n);
+	bareio_system_uart_puts("\n");
+
+	for (size_t i = 0; i < n; i++) {
+		uint64_t count = _bareio_profile_messages[i]->count;
+
+		if (!count) continue;
+
+		bareio_profile_put_uint(i);
+		bareio_system_uart_puts(" ");
+		bareio_profile_put_uint(count);
+		bareio_system_uart_puts("\n");
+	}
+
+	bareio_system_uart_puts("BAREIO-PROFILE-END\n");
+}
+#endif
 
 BAREIO_MESSAGE(globals, halt) {
+#ifdef BAREIO_PROFILE
+	bareio_profile_dump();
+#endif
+
 	bareio_system_halt();
 
 	return self;
@@ -25,17 +90,19 @@ BAREIO_MESSAGE(string, put) {
 }
 
 BAREIO_MESSAGE(string, putRange) {
-	BareioObject *start = bareio_run_in_context(message->arguments->members[0], locals);
-	BareioObject *end = bareio_run_in_context(message->arguments->members[1], locals);
+	BareioObject *start = bareio_evaluate_argument(message, 0, locals);
+	BareioObject *end = bareio_evaluate_argument(message, 1, locals);
 
-	bareio_system_uart_nputs(end->data_integer - start->data_integer, self->data_string->contents + start->data_integer);
+	int64_t start_index = bareio_integer_value(start);
+
+	bareio_system_uart_nputs(bareio_integer_value(end) - start_index, self->data_string->contents + start_index);
 	bareio_system_uart_puts("\n");
 
 	return self;
 }
 
 BAREIO_MESSAGE(integer, put) {
-	int64_t i = self->data_integer;
+	int64_t i = bareio_integer_value(self);
 	bool negative = i < 0;
 
 	char buffer[22];
@@ -63,6 +130,10 @@ BareioObject* bareio_run_in_context(BareioScript *script, BareioObject *context)
 	BareioObject *return_value = context;
 
 	for (BareioMessage *msg = script->messages; msg->name_offset != BAREIO_MESSAGES_END; msg++) {
+#ifdef BAREIO_PROFILE
+		msg->count++;
+#endif
+
 		if (msg->name_offset == BAREIO_MESSAGES_RESET_CONTEXT) {
 			cur_context = context;
 			continue;
@@ -72,14 +143,30 @@ BareioObject* bareio_run_in_context(BareioScript *script, BareioObject *context)
 			cur_context = return_value = msg->forced_result;
 		}
 
-		if (msg->name_offset < 0) {
-			cur_context = return_value = (cur_context->builtin_lookup(msg->name_offset))(cur_context, msg, context);
+		if (msg->resolved) {
+			cur_context = return_value = msg->resolved(cur_context, msg, context);
+		} else if (msg->name_offset < 0) {
+			cur_context = return_value = (bareio_object_lookup(cur_context)(msg->name_offset))(cur_context, msg, context);
 		}
 	}
 
 	return return_value;
 }
 
+BareioObject* bareio_evaluate_argument(BareioMessage *message, ptrdiff_t i, BareioObject *locals) {
+	uintptr_t member = (uintptr_t) message->arguments->members[i];
+
+	if (member & BAREIO_INTEGER_TAG) {
+		return (BareioObject*) member;
+	}
+
+	if (member & BAREIO_ARGUMENT_LITERAL) {
+		return (BareioObject*) (member & ~BAREIO_ARGUMENT_LITERAL);
+	}
+
+	return bareio_run_in_context((BareioScript*) member, locals);
+}
+
 extern BareioScript _builtin_script;
 extern BareioBuiltinLookupFunc _bareio_builtin_globals_lookup;
 
@@ -0,0 +1,33 @@
+## Builtin messages
+# Naming of builtin message functions and lookup tables, shared between the table generator and the
+# compiler, and the contexts file the former writes for the latter: a JSON object mapping each
+# context to the names of the builtin messages it implements.
+
+import json
+import re
+
+_func_disallowed_chars_pattern = re.compile(r'^[^A-Za-z_]|[^A-Za-z0-9_]')
+_lookup_name_pattern = re.compile(r'^_bareio_builtin_(.+)_lookup$')
+
+def func_name(context, message_name):
+	return _func_disallowed_chars_pattern.sub('_', f'bareio_builtin_{context}_{message_name}')
+
+def lookup_name(context):
+	return f'_bareio_builtin_{context}_lookup'
+
+def lookup_context(name):
+	"""Returns the context whose lookup function is `name`, or None."""
+	result = _lookup_name_pattern.match(name) if isinstance(name, str) else None
+
+	return result.group(1) if result else None
+
+def write_contexts(f, context_messages):
+	json.dump(
+		{context: sorted(messages) for context, messages in sorted(context_messages.items())},
+		f,
+		indent = '\t',
+	)
+	f.write('\n')
+
+def read_contexts(f):
+	return {context: set(messages) for context, messages in json.load(f).items()}
@@ -0,0 +1,124 @@
+## Build caches
+# A directory of pickled values, one file per key. The least recently used entries are evicted once
+# the cache grows past `max_size` bytes. Subclasses decide how keys are derived.
+
+import os
+import pickle
+import tempfile
+
+_ENTRY_SUFFIX = '.pickle'
+
+class PickleCache:
+	name = 'cache'
+
+	# Subclasses whose values are never modified once loaded may set this to a dict, to keep the values
+	# they load or store in memory for the life of the process (for the stage0 daemon). Keys are
+	# derived from everything the value depends on, so a remembered value is never out of date.
+	memory = None
+
+	def __init__(self, directory, max_size = 64 * 1024 * 1024):
+		self.directory = directory
+		self.max_size = max_size
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+		os.makedirs(directory, exist_ok = True)
+
+	def _entry_path(self, key):
+		return os.path.join(self.directory, key + _ENTRY_SUFFIX)
+
+	def get(self, key):
+		"""Returns the cached value for `key`, or None."""
+		entry_path = self._entry_path(key)
+
+		if self.memory is not None and entry_path in self.memory:
+			try:
+				# Mark the entry as recently used, which also checks it was not evicted meanwhile.
+				os.utime(entry_path)
+			except OSError:
+				del self.memory[entry_path]
+			else:
+				self.hits += 1
+
+				return self.memory[entry_path]
+
+		try:
+			with open(entry_path, 'rb') as f:
+				value = pickle.load(f)
+		except (OSError, EOFError, pickle.UnpicklingError):
+			self.misses += 1
+			return None
+
+		# Mark the entry as recently used for eviction.
+		try:
+			os.utime(entry_path)
+		except OSError:
+			pass
+
+		self.hits += 1
+
+		if self.memory is not None:
+			self.memory[entry_path] = value
+
+		return value
+
+	def put(self, key, value):
+		# Write to a tempfile and rename over, so concurrent builds never see partial entries.
+		entry_out = tempfile.NamedTemporaryFile(
+			dir = self.directory,
+			prefix = '.entry',
+			delete = False,
+		)
+
+		with entry_out:
+			pickle.dump(value, entry_out, protocol = pickle.HIGHEST_PROTOCOL)
+
+		os.replace(entry_out.name, self._entry_path(key))
+
+		if self.memory is not None:
+			self.memory[self._entry_path(key)] = value
+
+	def evict(self):
+		"""Removes least recently used entries until the cache fits in `max_size`."""
+		entries = []
+
+		for entry in os.scandir(self.directory):
+			if not entry.name.endswith(_ENTRY_SUFFIX):
+				continue
+
+			stat = entry.stat()
+			entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+		total_size = sum(size for _, size, _ in entries)
+
+		for _, size, path in sorted(entries):
+			if total_size <= self.max_size:
+				break
+
+			try:
+				os.unlink(path)
+			except OSError:
+				continue
+
+			if self.memory is not None:
+				self.memory.pop(path, None)
+
+			total_size -= size
+			self.evictions += 1
+
+	def stats(self):
+		lookups = self.hits + self.misses
+
+		return (
+			f'{self.name}: {self.hits}/{lookups} hits, {self.misses} misses, {self.evictions} evicted'
+		)
+
+def file_digest(path, digest):
+	"""Feeds the contents of the file at `path` into `digest`, and returns it."""
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1024 * 1024), b''):
+			digest.update(chunk)
+
+	return digest
@@ -0,0 +1,288 @@
+## Stage0 daemon
+# A long-lived process that runs the stage0 scripts without starting a new interpreter, so that each
+# build step skips interpreter startup and the imports (the parsy grammars) the scripts share.
+#
+# Clients (`stage0-run.py`) connect over a Unix socket and send one request, passing their stdin,
+# stdout and stderr along as file descriptors, so the script reads and writes them directly. The
+# request is a series of NUL-terminated fields: the protocol version, the script, the working
+# directory, the number of arguments, the arguments, then the environment as `NAME=VALUE`; the client
+# then shuts down its side for writing. The daemon replies with a line: either `status N`, the
+# script's exit status, or `fallback REASON`, asking for the script to be run directly instead.
+#
+# The protocol avoids anything that is slow to import, since the client starts for every build step.
+#
+# Each request is run in a process forked from the daemon, so that build steps run in parallel, and
+# scripts can change process-wide state (the working directory, `sys.argv`, the standard streams)
+# freely. What a script loads or caches itself (such as the generated struct classes) therefore only
+# lasts for its own request; only what the daemon imported up front is shared by all of them.
+
+import gc
+import os
+import runpy
+import socket
+import socketserver
+import sys
+import traceback
+
+from . import stats
+
+PROTOCOL_VERSION = 2
+
+# The directory the stage0 scripts and the `bareio` package live in.
+STAGE0_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_STREAM_COUNT = 3
+_MAX_REQUEST_SIZE = 1024 * 1024
+
+class DaemonError(Exception):
+	pass
+
+## Server
+def _module_stamps():
+	"""Returns the modification time of each loaded module from the stage0 directory."""
+	stamps = {}
+
+	for module in list(sys.modules.values()):
+		path = getattr(module, '__file__', None)
+
+		if path is None or not path.startswith(STAGE0_DIRECTORY):
+			continue
+
+		try:
+			stamps[path] = os.stat(path).st_mtime_ns
+		except OSError:
+			stamps[path] = None
+
+	return stamps
+
+def _exit_status(code):
+	if code is None:
+		return 0
+	elif isinstance(code, int):
+		return code
+
+	print(code, file = sys.stderr)
+
+	return 1
+
+def run_script(script, arguments, cwd, environment, streams):
+	"""
+	Runs `script` as `__main__` with `arguments`, in `cwd` and `environment`, with `streams` (file
+	descriptors for stdin, stdout and stderr) as its standard streams, and returns its exit status.
+	Everything the script changes in this process is restored after.
+	"""
+	saved_argv = sys.argv
+	saved_streams = sys.stdin, sys.stdout, sys.stderr
+	saved_environment = dict(os.environ)
+	saved_cwd = os.getcwd()
+
+	stdin, stdout, stderr = (
+		open(fd, mode, encoding = 'utf-8', errors = errors)
+		for fd, mode, errors in zip(streams, ['r', 'w', 'w'], ['strict', 'strict', 'backslashreplace'])
+	)
+
+	try:
+		sys.argv = [script, *arguments]
+		sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+		os.environ.clear()
+		os.environ.update(environment)
+		os.chdir(cwd)
+
+		try:
+			runpy.run_path(script, run_name = '__main__')
+			status = 0
+		except SystemExit as e:
+			status = _exit_status(e.code)
+		except KeyboardInterrupt:
+			# The daemon itself is being stopped.
+			raise
+		except BaseException:
+			traceback.print_exc()
+			status = 1
+
+		# Finalize what the script left behind, as exiting would, so its unclosed files are flushed.
+		gc.collect()
+		# A script that exited early never finished its statistics.
+		stats.discard()
+	finally:
+		for stream in (stdout, stderr, stdin):
+			try:
+				stream.close()
+			except OSError:
+				pass
+
+		sys.argv = saved_argv
+		sys.stdin, sys.stdout, sys.stderr = saved_streams
+		os.environ.clear()
+		os.environ.update(saved_environment)
+		os.chdir(saved_cwd)
+
+	return status
+
+def _parse_request(data):
+	"""
+	Returns the header of a request as a dict, with its `version`, or None if it is malformed. Fields
+	are decoded like `os.fsdecode`, so arguments and environment variables that are not UTF-8 survive.
+	"""
+	fields = [os.fsdecode(field) for field in data.split(b'\0')]
+
+	# The last field is empty, as every field is terminated.
+	if len(fields) < 2 or fields.pop():
+		return None
+
+	try:
+		version = int(fields[0])
+	except ValueError:
+		return None
+
+	if version != PROTOCOL_VERSION:
+		return {'version': version}
+
+	try:
+		script, cwd, argument_count = fields[1:4]
+		argument_count = int(argument_count)
+	except ValueError:
+		return None
+
+	arguments = fields[4:4 + argument_count]
+	environment = fields[4 + argument_count:]
+
+	if len(arguments) != argument_count or not all('=' in variable for variable in environment):
+		return None
+
+	return {
+		'version': version,
+		'script': script,
+		'arguments': arguments,
+		'cwd': cwd,
+		'environment': dict(variable.split('=', 1) for variable in environment),
+	}
+
+class _Handler(socketserver.BaseRequestHandler):
+	def handle(self):
+		data, fds, _, _ = socket.recv_fds(self.request, _MAX_REQUEST_SIZE, _STREAM_COUNT)
+
+		# The client shuts down its side once the whole request is sent.
+		while data and len(data) <= _MAX_REQUEST_SIZE:
+			chunk = self.request.recv(_MAX_REQUEST_SIZE)
+
+			if not chunk:
+				break
+
+			data += chunk
+
+		try:
+			reply = self.server.serve_request(_parse_request(data), fds)
+		finally:
+			# `run_script` closes the descriptors it used.
+			for fd in fds:
+				try:
+					os.close(fd)
+				except OSError:
+					pass
+
+		self.request.sendall(reply.encode('utf-8', 'backslashreplace') + b'\n')
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+	"""
+	Serves requests on `socket_path` until idle for `idle_timeout` seconds (None to never stop), each
+	in a forked process.
+	"""
+
+	def __init__(self, socket_path, idle_timeout = None):
+		self.socket_path = socket_path
+		self.timeout = idle_timeout
+		self.stopped = False
+		self.stale = []
+		self.requests = 0
+
+		self.module_stamps = _module_stamps()
+
+		super().__init__(socket_path, _Handler)
+
+	def server_bind(self):
+		# Replace the socket of a daemon that is no longer running.
+		try:
+			probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+			with probe:
+				probe.connect(self.socket_path)
+		except FileNotFoundError:
+			pass
+		except ConnectionRefusedError:
+			os.unlink(self.socket_path)
+		else:
+			raise DaemonError(f'a daemon is already listening on {self.socket_path}')
+
+		super().server_bind()
+
+	def stale_modules(self):
+		"""Returns the loaded stage0 modules changed since they were loaded."""
+		stamps = _module_stamps()
+
+		for path, stamp in stamps.items():
+			self.module_stamps.setdefault(path, stamp)
+
+		return sorted(path for path, stamp in stamps.items() if self.module_stamps[path] != stamp)
+
+	def process_request(self, request, client_address):
+		# Checked before forking, so that the daemon itself stops once stage0 changes.
+		self.stale = self.stale_modules()
+
+		if self.stale:
+			self.stopped = True
+			self.finish_request(request, client_address)
+			self.shutdown_request(request)
+		else:
+			self.requests += 1
+			super().process_request(request, client_address)
+
+	def serve_request(self, header, fds):
+		"""Runs the script `header` asks for, and returns the reply to send. Called in the forked process."""
+		if header is None:
+			return 'fallback malformed request'
+
+		if header['version'] != PROTOCOL_VERSION:
+			return f'fallback unsupported protocol version: {header["version"]}'
+
+		if len(fds) != _STREAM_COUNT:
+			return 'fallback standard streams not passed'
+
+		if os.path.dirname(os.path.realpath(header['script'])) != os.path.realpath(STAGE0_DIRECTORY):
+			return f'fallback not a script of this daemon: {header["script"]}'
+
+		if self.stale:
+			# Modules cannot be safely reloaded in place; stop, and let the next build start afresh.
+			return f'fallback stage0 changed: {", ".join(self.stale)}'
+
+		status = run_script(
+			header['script'],
+			header['arguments'],
+			header['cwd'],
+			header['environment'],
+			[os.dup(fd) for fd in fds],
+		)
+
+		return f'status {status}'
+
+	def handle_timeout(self):
+		self.stopped = True
+
+	def serve(self):
+		# Keep the garbage collector off what the daemon loaded up front, so that forked processes share
+		# it with the daemon instead of copying the pages it would touch.
+		gc.freeze()
+
+		try:
+			while not self.stopped:
+				self.handle_request()
+				# Reap the processes of finished requests.
+				self.service_actions()
+		finally:
+			# Waits for the requests still running.
+			self.server_close()
+
+			try:
+				os.unlink(self.socket_path)
+			except OSError:
+				pass
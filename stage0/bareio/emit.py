@@ -0,0 +1,531 @@
+## Emitters
+# The generated struct classes and the compiler describe their output as a series of calls on an
+# emitter: labels, fixed-width words (either integers, references to labels/symbols, or `Offset`s
+# from them), strings and alignment. `AsmEmitter` writes these out as assembler directives;
+# `ElfEmitter` assembles them straight into an ELF relocatable object.
+#
+# `words` is a shorthand for an optional label followed by a run of words of the same width, which
+# is how the generated struct classes emit most of a struct in one call.
+
+from collections import namedtuple
+import struct
+import sys
+
+from . import stats
+
+class Offset(namedtuple('Offset', ['target', 'addend'])):
+	"""A word value `addend` bytes past the label or symbol `target`."""
+
+	def __str__(self):
+		return f'{self.target}+{self.addend}'
+
+class AsmEmitter:
+	"""
+	Writes assembler directives to `file`. Lines are buffered and written out in batches, and on
+	`close`, which must be called.
+	"""
+
+	# Writes (lines, or the block of a `words` call) buffered before the file is written to.
+	BUFFER_LINES = 4096
+
+	def __init__(self, file = None):
+		self.file = file or sys.stdout
+		self._lines = []
+		# (width, count, labelled) -> format of a `words` call
+		self._formats = {}
+
+	def _write(self, line):
+		self._lines.append(line)
+
+		if len(self._lines) >= self.BUFFER_LINES:
+			self.flush()
+
+	def flush(self):
+		if self._lines:
+			self._lines.append('')
+			text = '\n'.join(self._lines)
+			self.file.write(text)
+			self._lines.clear()
+
+			stats.count('bytes_written', len(text))
+
+	def section(self, name):
+		self._write(f'.section {name}')
+
+	def global_symbol(self, name):
+		self._write(f'.global {name}')
+
+	def label(self, name):
+		self._write(f'{name}:')
+
+	def word(self, width, value):
+		self._write(f'.{width}byte {value}')
+
+	def words(self, width, values, label = None):
+		key = (width, len(values), label is not None)
+		template = self._formats.get(key)
+
+		if template is None:
+			template = self._formats[key] = '\n'.join(
+				(['{}:'] if label is not None else []) + [f'.{width}byte {{}}'] * len(values)
+			)
+
+		if template:
+			self._write(template.format(label, *values) if label is not None else template.format(*values))
+
+	def string(self, s):
+		self._write('.ascii "' + _escape_str(s) + '"')
+
+	def align(self, alignment):
+		self._write(f'.align {alignment}')
+
+	def close(self):
+		self.flush()
+		self.file.flush()
+
+class SizeEmitter:
+	"""Counts the bytes that would be emitted in each section, with alignment as in `ElfEmitter`."""
+
+	def __init__(self):
+		# Section name -> size, with None for anything emitted before the first section.
+		self.sections = {}
+		self.current = None
+
+	@property
+	def size(self):
+		return sum(self.sections.values())
+
+	def _add(self, size):
+		self.sections[self.current] = self.sections.get(self.current, 0) + size
+
+	def section(self, name):
+		self.current = name
+
+	def global_symbol(self, name):
+		pass
+
+	def label(self, name):
+		pass
+
+	def word(self, width, value):
+		self._add(width)
+
+	def words(self, width, values, label = None):
+		self._add(width * len(values))
+
+	def string(self, s):
+		self._add(len(s.encode('utf-8')))
+
+	def align(self, alignment):
+		self._add(-self.sections.get(self.current, 0) % (1 << alignment))
+
+	def close(self):
+		pass
+
+class TeeEmitter:
+	"""Passes every call on to each of `emitters`."""
+
+	def __init__(self, *emitters):
+		self.emitters = emitters
+
+	def __getattr__(self, name):
+		methods = [getattr(emitter, name) for emitter in self.emitters]
+
+		def call(*args, **kwargs):
+			for method in methods:
+				method(*args, **kwargs)
+
+		return call
+
+class RecordingEmitter:
+	"""
+	Records emitter calls, so they can be cached and replayed into another emitter later. Only calls
+	within a section (labels, words, strings and alignment) are recorded.
+	"""
+
+	def __init__(self):
+		self.calls = []
+
+	# Recordings are replayed into whatever section the caller is emitting, and their labels may be
+	# renamed, so they can neither switch sections nor export symbols.
+	def section(self, name):
+		raise ValueError(f'a recording cannot switch sections (to {name}); it is replayed into the current one')
+
+	def global_symbol(self, name):
+		raise ValueError(f'a recording cannot define global symbols (such as {name}); its labels are local')
+
+	def label(self, name):
+		self.calls.append(('label', name))
+
+	def word(self, width, value):
+		self.calls.append(('word', width, value))
+
+	def words(self, width, values, label = None):
+		# Recorded as separate calls, so replaying into any emitter needs no special case.
+		if label is not None:
+			self.calls.append(('label', label))
+
+		self.calls += [('word', width, value) for value in values]
+
+	def string(self, s):
+		self.calls.append(('string', s))
+
+	def align(self, alignment):
+		self.calls.append(('align', alignment))
+
+	def close(self):
+		pass
+
+	def defined_labels(self):
+		return {call[1] for call in self.calls if call[0] == 'label'}
+
+def replay(calls, out, rename = None):
+	"""
+	Replays recorded `calls` into `out`. Labels in `rename` (a dict) are replaced both where they are
+	defined and where they are referenced.
+	"""
+	rename = rename or {}
+
+	for call in calls:
+		kind = call[0]
+
+		if kind == 'label':
+			out.label(rename.get(call[1], call[1]))
+		elif kind == 'word':
+			value = call[2]
+
+			if isinstance(value, str):
+				value = rename.get(value, value)
+			elif isinstance(value, Offset):
+				value = Offset(rename.get(value.target, value.target), value.addend)
+
+			out.word(call[1], value)
+		elif kind == 'string':
+			out.string(call[1])
+		elif kind == 'align':
+			out.align(call[1])
+
+def _escape_str(s):
+	return s.encode('utf-8').decode('latin-1').encode('unicode_escape').decode('latin-1')
+
+## ELF output
+EM_AARCH64 = 183
+
+ET_REL = 1
+
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_RELA = 4
+SHT_NOBITS = 8
+
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_INFO_LINK = 0x40
+
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STT_NOTYPE = 0
+STT_SECTION = 3
+
+# Absolute relocation types by ELF class (as the target's word size) and word width.
+_ABS_RELOCATIONS = {
+	EM_AARCH64: {
+		8: {8: 257, 4: 258, 2: 259},  # R_AARCH64_ABS64, ABS32, ABS16
+		4: {4: 1, 2: 2},  # R_AARCH64_P32_ABS32, P32_ABS16 (ILP32)
+	},
+}
+
+# The structures whose layout differs between ELF64 and ELF32, by the target's word size: the
+# `EI_CLASS` identification byte and the struct formats of the ELF header, section headers, symbols
+# and relocations, and how far the symbol index is shifted in a relocation's `r_info`.
+_ElfClass = namedtuple('_ElfClass', ['ident', 'header', 'section_header', 'symbol', 'relocation', 'symbol_shift'])
+
+_ELF_CLASSES = {
+	8: _ElfClass(2, '<4sBBBBB7sHHIQQQIHHHHHH', '<IIQQQQIIQQ', '<IBBHQQ', '<QQq', 32),
+	4: _ElfClass(1, '<4sBBBBB7sHHIIIIIHHHHHH', '<IIIIIIIIII', '<IIIBBH', '<IIi', 8),
+}
+
+_SECTION_FLAGS = {
+	'.data': SHF_WRITE | SHF_ALLOC,
+	'.rodata': SHF_ALLOC,
+}
+
+class _StringTable:
+	def __init__(self):
+		self.data = bytearray(b'\0')
+		self.offsets = {'': 0}
+
+	def add(self, s):
+		if s not in self.offsets:
+			self.offsets[s] = len(self.data)
+			self.data += s.encode('utf-8') + b'\0'
+
+		return self.offsets[s]
+
+class _Section:
+	def __init__(self, name):
+		self.name = name
+		self.data = bytearray()
+		self.alignment = 1
+		# (offset, width, symbol name, addend)
+		self.relocations = []
+
+class ElfEmitter:
+	"""
+	Assembles emitter calls into a little-endian relocatable object, written to `file` (a binary
+	stream) on `close`: ELF64, or ELF32 for a target with 4-byte words. References to labels become
+	relocations against the section they live in; references to anything else become undefined symbols
+	for the linker to resolve.
+	"""
+
+	def __init__(self, file = None, machine = EM_AARCH64, word_size = 8):
+		self.file = file or sys.stdout.buffer
+		self.machine = machine
+		self.word_size = word_size
+		self.sections = {}
+		self.current = None
+		# label -> (section, offset)
+		self.labels = {}
+		self.globals = set()
+
+	def section(self, name):
+		self.current = self.sections.setdefault(name, _Section(name))
+
+	def global_symbol(self, name):
+		self.globals.add(name)
+
+	def label(self, name):
+		self.labels[name] = (self.current, len(self.current.data))
+
+	def word(self, width, value):
+		section = self.current
+		section.alignment = max(section.alignment, width)
+
+		if isinstance(value, str):
+			section.relocations.append((len(section.data), width, value, 0))
+			value = 0
+		elif isinstance(value, Offset):
+			section.relocations.append((len(section.data), width, value.target, value.addend))
+			value = 0
+
+		section.data += (value & ((1 << (width * 8)) - 1)).to_bytes(width, 'little')
+
+	def words(self, width, values, label = None):
+		if label is not None:
+			self.label(label)
+
+		for value in values:
+			self.word(width, value)
+
+	def string(self, s):
+		self.current.data += s.encode('utf-8')
+
+	def align(self, alignment):
+		# Follows the AArch64 assembler, where `.align n` aligns to 2**n bytes.
+		size = 1 << alignment
+		section = self.current
+		section.alignment = max(section.alignment, size)
+		section.data += b'\0' * (-len(section.data) % size)
+
+	def close(self):
+		data = self._assemble()
+		self.file.write(data)
+		self.file.flush()
+
+		stats.count('bytes_written', len(data))
+
+	def _assemble(self):
+		shstrtab = _StringTable()
+		strtab = _StringTable()
+		relocation_types = _ABS_RELOCATIONS[self.machine][self.word_size]
+		elf_class = _ELF_CLASSES[self.word_size]
+
+		sections = list(self.sections.values())
+		# Section indices: 0 is null, then the content sections, then a .rela section for each content
+		# section with relocations, then .symtab, .strtab and .shstrtab.
+		section_indices = {section.name: i + 1 for i, section in enumerate(sections)}
+
+		### Symbols
+		# (name, info, shndx, value)
+		local_symbols = [('', 0, 0, 0)]
+		local_symbols += [('', STT_SECTION, section_indices[section.name], 0) for section in sections]
+		section_symbols = {section.name: i + 1 for i, section in enumerate(sections)}
+
+		global_symbols = []
+		symbol_indices = {}
+
+		for name, (section, offset) in self.labels.items():
+			if name in self.globals:
+				global_symbols.append((name, (STB_GLOBAL << 4) | STT_NOTYPE, section_indices[section.name], offset))
+			else:
+				local_symbols.append((name, (STB_LOCAL << 4) | STT_NOTYPE, section_indices[section.name], offset))
+
+		undefined = []
+
+		for section in sections:
+			for _, _, name, _ in section.relocations:
+				if name not in self.labels and name not in undefined:
+					undefined.append(name)
+
+		for name in undefined:
+			global_symbols.append((name, (STB_GLOBAL << 4) | STT_NOTYPE, 0, 0))
+
+		symbols = local_symbols + global_symbols
+
+		for i, (name, _, _, _) in enumerate(symbols):
+			if name:
+				symbol_indices[name] = i
+
+		if self.word_size == 8:
+			symtab = b''.join(
+				struct.pack(elf_class.symbol, strtab.add(name), info, 0, shndx, value, 0)
+				for name, info, shndx, value
+				in symbols
+			)
+		else:
+			symtab = b''.join(
+				struct.pack(elf_class.symbol, strtab.add(name), value, 0, info, 0, shndx)
+				for name, info, shndx, value
+				in symbols
+			)
+
+		### Relocations
+		relocation_sections = []
+
+		for section in sections:
+			if not section.relocations:
+				continue
+
+			entries = bytearray()
+
+			for offset, width, name, addend in section.relocations:
+				if name in self.labels:
+					# Local labels are referenced through their section symbol, like the assembler does.
+					target_section, target_offset = self.labels[name]
+
+					if name in self.globals:
+						symbol = symbol_indices[name]
+					else:
+						symbol, addend = section_symbols[target_section.name], target_offset + addend
+				else:
+					symbol = symbol_indices[name]
+
+				try:
+					relocation_type = relocation_types[width]
+				except KeyError:
+					raise ValueError(f'no {width}-byte relocation for {self.word_size}-byte words') from None
+
+				entries += struct.pack(elf_class.relocation, offset, (symbol << elf_class.symbol_shift) | relocation_type, addend)
+
+			relocation_sections.append((section, bytes(entries)))
+
+		### Layout
+		symtab_index = 1 + len(sections) + len(relocation_sections)
+		strtab_index = symtab_index + 1
+		shstrtab_index = strtab_index + 1
+
+		# (name, type, flags, data, link, info, addralign, entsize)
+		headers = [('', 0, 0, b'', 0, 0, 0, 0)]
+
+		for section in sections:
+			headers.append((
+				section.name,
+				SHT_PROGBITS,
+				_SECTION_FLAGS.get(section.name, SHF_WRITE | SHF_ALLOC),
+				bytes(section.data),
+				0,
+				0,
+				section.alignment,
+				0,
+			))
+
+		for section, entries in relocation_sections:
+			headers.append((
+				f'.rela{section.name}',
+				SHT_RELA,
+				SHF_INFO_LINK,
+				entries,
+				symtab_index,
+				section_indices[section.name],
+				self.word_size,
+				struct.calcsize(elf_class.relocation),
+			))
+
+		headers.append((
+			'.symtab',
+			SHT_SYMTAB,
+			0,
+			symtab,
+			strtab_index,
+			len(local_symbols),
+			self.word_size,
+			struct.calcsize(elf_class.symbol),
+		))
+		headers.append(('.strtab', SHT_STRTAB, 0, bytes(strtab.data), 0, 0, 1, 0))
+
+		for header in headers:
+			shstrtab.add(header[0])
+
+		shstrtab.add('.shstrtab')
+		headers.append(('.shstrtab', SHT_STRTAB, 0, bytes(shstrtab.data), 0, 0, 1, 0))
+
+		ELF_HEADER_SIZE = struct.calcsize(elf_class.header)
+		SECTION_HEADER_SIZE = struct.calcsize(elf_class.section_header)
+
+		body = bytearray()
+		offsets = []
+
+		for _, _, _, data, _, _, addralign, _ in headers:
+			position = ELF_HEADER_SIZE + len(body)
+			padding = -position % max(addralign, 1)
+			body += b'\0' * padding
+			offsets.append(ELF_HEADER_SIZE + len(body))
+			body += data
+
+		body += b'\0' * (-(ELF_HEADER_SIZE + len(body)) % self.word_size)
+		shoff = ELF_HEADER_SIZE + len(body)
+
+		elf_header = struct.pack(
+			elf_class.header,
+			b'\x7fELF',
+			elf_class.ident,  # ELFCLASS64 or ELFCLASS32
+			1,  # ELFDATA2LSB
+			1,  # EV_CURRENT
+			0,  # ELFOSABI_NONE
+			0,
+			b'',
+			ET_REL,
+			self.machine,
+			1,
+			0,
+			0,
+			shoff,
+			0,
+			ELF_HEADER_SIZE,
+			0,
+			0,
+			SECTION_HEADER_SIZE,
+			len(headers),
+			shstrtab_index,
+		)
+
+		section_headers = b''.join(
+			struct.pack(
+				elf_class.section_header,
+				shstrtab.offsets[name],
+				sh_type,
+				flags,
+				0,
+				offset if sh_type else 0,
+				len(data),
+				link,
+				info,
+				addralign,
+				entsize,
+			)
+			for (name, sh_type, flags, data, link, info, addralign, entsize), offset
+			in zip(headers, offsets)
+		)
+
+		return elf_header + bytes(body) + section_headers
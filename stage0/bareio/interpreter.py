@@ -0,0 +1,433 @@
+## Reference interpreter
+# Runs builtin scripts on the host, with the semantics of `bareio_run_in_context` in `src/main.c`,
+# so scripts can be tried without building the kernel and booting it. Scripts come either straight
+# from the parser's AST, or from an object written by `compiler.py --format elf`, which makes the
+# interpreter an oracle for the compiler: both should print the same.
+#
+# Either way, a script becomes a list of `Message`s, run one after another:
+# * A context reset sets the current context back to the script's.
+# * A `forced_result` becomes the current context and the result.
+# * A send (with `resolved`, or looked up by name in the current context's builtins) calls the
+#   builtin, whose result becomes the current context and the result.
+#
+# Only the builtins in `BUILTINS` are known; keep them in step with the `BAREIO_MESSAGE`s in main.c.
+
+from bisect import bisect_right
+from collections import namedtuple
+import struct
+import time
+
+from . import builtins, parser, target
+from .llvm_dwarfdump import native
+
+Object = namedtuple('Object', ['context', 'value'])
+
+# `name` is the message sent (None if none), `arguments` a list of argument scripts or, for literal
+# arguments, `Object`s, and `resolved` the `(context, name)` of the builtin to call without lookup.
+# `key` identifies the message in timing reports.
+Message = namedtuple('Message', ['name', 'forced_result', 'arguments', 'resolved', 'reset', 'key'])
+
+GLOBALS = Object('globals', None)
+
+class InterpreterError(Exception):
+	pass
+
+class Halt(Exception):
+	pass
+
+## Builtins
+def _globals_halt(interpreter, self, message, locals):
+	raise Halt()
+
+def _string_put(interpreter, self, message, locals):
+	interpreter.out.write(self.value + b'\n')
+
+	return self
+
+def _string_put_range(interpreter, self, message, locals):
+	start = interpreter.integer_value(interpreter.evaluate_argument(message, 0, locals))
+	end = interpreter.integer_value(interpreter.evaluate_argument(message, 1, locals))
+
+	if not 0 <= start <= end <= len(self.value):
+		raise InterpreterError(f'putRange({start}, {end}) out of range for a string of {len(self.value)} bytes')
+
+	interpreter.out.write(self.value[start:end] + b'\n')
+
+	return self
+
+def _integer_put(interpreter, self, message, locals):
+	interpreter.out.write(f'{self.value}\n'.encode('utf-8'))
+
+	return self
+
+BUILTINS = {
+	('globals', 'halt'): _globals_halt,
+	('string', 'put'): _string_put,
+	('string', 'putRange'): _string_put_range,
+	('integer', 'put'): _integer_put,
+}
+
+## Interpreter
+class Interpreter:
+	"""
+	Runs scripts, writing their output to `out` (a binary stream). With `timed`, the time spent in each
+	message (including any argument scripts it runs) is totalled in `timings`, as `key -> [count,
+	nanoseconds]`.
+	"""
+
+	def __init__(self, out, timed = False):
+		self.out = out
+		self.timed = timed
+		self.timings = {}
+
+	def run(self, messages):
+		"""Runs the top-level script `messages` in the globals. Returns whether it halted."""
+		try:
+			self.run_in_context(messages, GLOBALS)
+		except Halt:
+			return True
+
+		return False
+
+	def run_in_context(self, messages, context):
+		cur_context = context
+		return_value = context
+
+		for message in messages:
+			if message.reset:
+				cur_context = context
+				continue
+
+			if self.timed:
+				start = time.perf_counter_ns()
+
+			try:
+				if message.forced_result is not None:
+					cur_context = return_value = message.forced_result
+
+				if message.resolved is not None:
+					cur_context = return_value = self.call(message.resolved, cur_context, message, context)
+				elif message.name is not None:
+					cur_context = return_value = self.call(
+						(cur_context.context, message.name),
+						cur_context,
+						message,
+						context,
+					)
+			finally:
+				if self.timed:
+					timing = self.timings.setdefault(message.key, [0, 0])
+					timing[0] += 1
+					timing[1] += time.perf_counter_ns() - start
+
+		return return_value
+
+	def call(self, builtin, receiver, message, locals):
+		try:
+			function = BUILTINS[builtin]
+		except KeyError:
+			context, name = builtin
+			raise InterpreterError(f'{context} has no builtin message {name}') from None
+
+		return function(self, receiver, message, locals)
+
+	def evaluate_argument(self, message, i, locals):
+		argument = message.arguments[i]
+
+		if isinstance(argument, Object):
+			return argument
+
+		return self.run_in_context(argument, locals)
+
+	def integer_value(self, o):
+		if o.context != 'integer':
+			raise InterpreterError(f'expected an integer, got {o.context}')
+
+		return o.value
+
+def report_timings(timings, top = None):
+	"""Returns lines reporting `timings`, most time first."""
+	total = sum(nanoseconds for _, nanoseconds in timings.values()) or 1
+	rows = sorted(timings.items(), key = lambda row: -row[1][1])[:top]
+
+	return [
+		f'{count:10} {nanoseconds / 1000:12.1f}us {nanoseconds / total * 100:6.2f}% '
+		f'{nanoseconds / count:10.0f}ns/run  {location:30} {description}'
+		for (location, description), (count, nanoseconds) in rows
+	]
+
+## Scripts from source
+def from_ast(script, source = '<stdin>', text = ''):
+	"""
+	Returns the messages of the parsed `script`. `text` is the source it was parsed from, for the
+	positions in timing keys.
+	"""
+	line_starts = [0] + [i + 1 for i, c in enumerate(text) if c == '\n']
+
+	def _key(node, description):
+		position = getattr(node, 'position', None)
+
+		if position is None:
+			return (source, description)
+
+		line = bisect_right(line_starts, position)
+
+		return (f'{source}:{line}:{position - line_starts[line - 1] + 1}', description)
+
+	def _messages(script):
+		return [_message(node) for node in script.children]
+
+	def _message(node):
+		if isinstance(node, parser.String):
+			literal = Object('string', node.contents.encode('utf-8'))
+
+			return Message(None, literal, [], None, False, _key(node, f'"{node.contents}"'))
+		elif isinstance(node, parser.Integer):
+			literal = Object('integer', node.value)
+
+			return Message(None, literal, [], None, False, _key(node, str(node.value)))
+		elif isinstance(node, parser.NamedMessage):
+			arguments = [_messages(argument) for argument in node.children]
+
+			return Message(node.name, None, arguments, None, False, _key(node, node.name))
+		elif isinstance(node, parser.ResetContext):
+			return Message(None, None, [], None, True, _key(node, '(newline)'))
+
+		raise InterpreterError(f'unhandled node: {node!r}')
+
+	return _messages(script)
+
+## Scripts from objects
+# Mirrors the structs in `src/bio-types.h`: every field is a word.
+SCRIPT_HEADER_WORDS = 1
+MESSAGE_WORDS = 4
+MESSAGES_RESET_CONTEXT = -2
+MESSAGES_END = -1
+INTEGER_TAG = 1
+ARGUMENT_LITERAL = 2
+
+SHT_SYMTAB = 2
+SHT_RELA = 4
+STT_SECTION = 3
+
+# Widths of the absolute relocations the compiler emits, by ELF class (as the word size):
+# R_AARCH64_ABS64, ABS32 and ABS16, or for ILP32, R_AARCH64_P32_ABS32 and P32_ABS16.
+_RELOCATION_WIDTHS = {8: {257: 8, 258: 4, 259: 2}, 4: {1: 4, 2: 2}}
+
+# Where sections and undefined symbols are placed when loading an object.
+_SECTIONS_BASE = 0x10000
+_EXTERNALS_BASE = 0x40000000
+
+class Image:
+	"""
+	The sections of a relocatable object laid out in memory, with relocations applied. Undefined
+	symbols get addresses of their own, in `externals`.
+	"""
+
+	def __init__(self, path):
+		with native.ElfObject(path) as elf:
+			self.word_size = 8 if elf.is_64 else 4
+			self.byteorder = elf.byteorder
+			endian = elf.endian
+
+			# (start, data) of each section with contents, by index
+			self.sections = {}
+			address = _SECTIONS_BASE
+
+			for i, (_, _, _, _, _, size, _, _, alignment, _) in enumerate(elf.section_headers):
+				name = elf.section_names[i]
+
+				if name not in ('.data', '.rodata') and not name.startswith(('.data.', '.rodata.')):
+					continue
+
+				address += -address % max(alignment, 1)
+				self.sections[i] = (address, bytearray(elf.section_contents(i)))
+				address += size
+
+			### Symbols
+			symtab_index = next(i for i, header in enumerate(elf.section_headers) if header[1] == SHT_SYMTAB)
+			strtab = elf.section_contents(elf.section_headers[symtab_index][6])
+			symtab = elf.section_contents(symtab_index)
+
+			if elf.is_64:
+				entries = ((n, i, x, v) for n, i, _, x, v, _ in struct.iter_unpack(endian + 'IBBHQQ', symtab))
+			else:
+				entries = ((n, i, x, v) for n, v, _, i, _, x in struct.iter_unpack(endian + 'IIIBBH', symtab))
+
+			# Address of each symbol, by index
+			addresses = []
+			self.symbols = {}
+			self.externals = {}
+
+			for name_offset, info, shndx, value in entries:
+				name = strtab[name_offset:strtab.index(b'\0', name_offset)].decode('utf-8')
+
+				if shndx in self.sections:
+					symbol_address = self.sections[shndx][0] + (0 if info & 0xf == STT_SECTION else value)
+				elif shndx == 0 and name:
+					symbol_address = _EXTERNALS_BASE + 16 * len(self.externals)
+					self.externals[symbol_address] = name
+				else:
+					symbol_address = 0
+
+				addresses.append(symbol_address)
+
+				if name:
+					self.symbols[name] = symbol_address
+
+			### Relocations
+			rela_format = endian + ('QQq' if elf.is_64 else 'IIi')
+			symbol_shift = 32 if elf.is_64 else 8
+
+			for i, (_, sh_type, _, _, _, _, _, info, _, _) in enumerate(elf.section_headers):
+				if sh_type != SHT_RELA or info not in self.sections:
+					continue
+
+				_, data = self.sections[info]
+
+				for offset, relocation_info, addend in struct.iter_unpack(rela_format, elf.section_contents(i)):
+					relocation_type = relocation_info & ((1 << symbol_shift) - 1)
+
+					try:
+						width = _RELOCATION_WIDTHS[self.word_size][relocation_type]
+					except KeyError:
+						raise InterpreterError(f'{path}: unsupported relocation type {relocation_type}') from None
+
+					value = addresses[relocation_info >> symbol_shift] + addend
+					data[offset:offset + width] = (value & ((1 << (width * 8)) - 1)).to_bytes(width, self.byteorder)
+
+		self.labels = {address: name for name, address in self.symbols.items()}
+
+	def signed(self, value):
+		sign = 1 << (self.word_size * 8 - 1)
+
+		return (value ^ sign) - sign
+
+	def word(self, address, signed = False):
+		for start, data in self.sections.values():
+			if start <= address < start + len(data):
+				offset = address - start
+
+				return int.from_bytes(data[offset:offset + self.word_size], self.byteorder, signed = signed)
+
+		raise InterpreterError(f'address {address:#x} is outside the image')
+
+	def bytes(self, address, size):
+		for start, data in self.sections.values():
+			if start <= address and address + size <= start + len(data):
+				return bytes(data[address - start:address - start + size])
+
+		raise InterpreterError(f'address {address:#x} is outside the image')
+
+def from_object(path, lock_file, entry = '_builtin_script'):
+	"""
+	Returns the messages of the script at the symbol `entry` in the object at `path`, written by
+	`compiler.py --format elf`. `lock_file` is the message name lock file it was compiled with.
+	"""
+	image = Image(path)
+	w = image.word_size
+
+	with open(lock_file, encoding = 'utf-8') as f:
+		builtin_message_base = target.for_word_size(w).word_min
+		message_names = {builtin_message_base + i: name.strip() for i, name in enumerate(f)}
+
+	resolved_names = {
+		builtins.func_name(context, name): (context, name)
+		for context, name in BUILTINS
+	}
+
+	# Profiling builds give every message a counter, and list them in this table.
+	message_words = MESSAGE_WORDS + ('_bareio_profile_messages' in image.symbols)
+
+	objects = {}
+
+	def _symbol(address):
+		if address not in image.externals:
+			raise InterpreterError(f'expected a symbol at {address:#x}')
+
+		return image.externals[address]
+
+	def _object(reference):
+		if reference & INTEGER_TAG:
+			return Object('integer', image.signed(reference) >> 1)
+
+		if reference not in objects:
+			context = builtins.lookup_context(_symbol(image.word(reference)))
+
+			if context == 'string':
+				string = image.word(reference + w)
+				value = image.bytes(string + w, image.word(string))
+			else:
+				value = image.word(reference + w, signed = True)
+
+			objects[reference] = Object(context, value)
+
+		return objects[reference]
+
+	def _argument(member):
+		if member & INTEGER_TAG:
+			return _object(member)
+		elif member & ARGUMENT_LITERAL:
+			return _object(member & ~ARGUMENT_LITERAL)
+
+		return _script(member)
+
+	def _script(address):
+		messages = []
+		address += SCRIPT_HEADER_WORDS * w
+
+		while True:
+			name_offset, forced_result, arguments, resolved = (
+				image.word(address + i * w, signed = i == 0) for i in range(4)
+			)
+
+			if name_offset == MESSAGES_END:
+				return messages
+
+			name = message_names.get(name_offset) if name_offset < 0 else None
+			literal = _object(forced_result) if forced_result else None
+			key = (image.labels.get(address, f'{address:#x}'), name or _describe(literal))
+
+			if resolved:
+				symbol = _symbol(resolved)
+
+				try:
+					resolved = resolved_names[symbol]
+				except KeyError:
+					raise InterpreterError(f'message resolved to unknown builtin {symbol}') from None
+			else:
+				resolved = None
+
+			if name_offset < 0 and name_offset != MESSAGES_RESET_CONTEXT and name is None:
+				raise InterpreterError(f'message offset {name_offset} is not in the lock file')
+
+			argument_list = []
+
+			if arguments:
+				argument_list = [
+					_argument(image.word(arguments + (1 + i) * w))
+					for i in range(image.word(arguments))
+				]
+
+			messages.append(Message(
+				name,
+				literal,
+				argument_list,
+				resolved,
+				name_offset == MESSAGES_RESET_CONTEXT,
+				key,
+			))
+			address += message_words * w
+
+	def _describe(literal):
+		if literal is None:
+			return ''
+		elif literal.context == 'string':
+			return '"' + literal.value.decode('utf-8', 'replace') + '"'
+
+		return str(literal.value)
+
+	try:
+		return _script(image.symbols[entry])
+	except KeyError:
+		raise InterpreterError(f'{path}: no {entry} symbol') from None
@@ -1,8 +1,14 @@
 from collections import namedtuple
+import concurrent.futures
+import subprocess
 
-from . import parser
+from .. import stats
+from . import native, parser, store
 
-DwarfStruct = namedtuple('DwarfStruct', ['name', 'children'])
+# `addr_size` is that of the unit the struct was collected from, so structs from units with different
+# address sizes never merge. `references` is the frozenset of the names of the structs its members
+# refer to (see `prune_unreachable`), which don't have to be defined in the same unit or object.
+DwarfStruct = namedtuple('DwarfStruct', ['name', 'children', 'addr_size', 'references'])
 DwarfMemberValue = namedtuple('DwarfMemberValue', ['name', 'width'])
 DwarfMemberPointer = namedtuple('DwarfMemberPointer', ['name', 'width'])
 DwarfMemberUnion = namedtuple('DwarfMemberUnion', ['children'])
@@ -10,7 +16,183 @@ DwarfMemberFlexibleStructArray = namedtuple('DwarfMemberFlexibleStructArray', ['
 DwarfMemberFlexibleValueArray = namedtuple('DwarfMemberFlexibleValueArray', ['name', 'type', 'width'])
 DwarfMemberFlexiblePointerArray = namedtuple('DwarfMemberFlexiblePointerArray', ['name', 'type', 'width'])
 
-def collect_structs(dwarfdump_output):
+class LayoutConflictError(Exception):
+	"""Raised when two compilation units or objects define a struct differently."""
+
+	def __init__(self, name, first, second):
+		super().__init__(f'struct {name} has different layouts in {first} and {second}')
+		self.name = name
+
+def _merge_struct(structs, origins, struct, origin):
+	"""
+	Adds `struct`, collected from `origin`, to `structs`, unless an identical one is already there. A
+	struct without members (only declared) never replaces or conflicts with one that has them.
+	"""
+	existing = structs.get(struct.name)
+
+	if existing is None or not existing.children or struct.name is None:
+		structs[struct.name] = struct
+		origins[struct.name] = origin
+	elif struct.children and struct._replace(references = existing.references) != existing:
+		raise LayoutConflictError(struct.name, origins[struct.name], origin)
+	elif not struct.references <= existing.references:
+		# The same layout can name the structs it points to differently (by typedef or struct tag).
+		structs[struct.name] = existing._replace(references = existing.references | struct.references)
+
+def prune_unreachable(structs, roots):
+	"""
+	Returns the structs in `structs` (a dict by name) that the names in `roots` reach through their
+	members (directly, or through pointers, arrays, typedefs and unions), in the same order.
+
+	This works on the merged structs of every unit and object, so a struct is reached even if the one
+	referring to it was collected from another object than its definition.
+	"""
+	reached = _reachable({name: struct.references for name, struct in structs.items()}, roots)
+
+	return {name: struct for name, struct in structs.items() if name in reached}
+
+def _reachable(references, roots):
+	"""
+	Returns the set of names that the names in `roots` reach in `references`, a dict mapping each name
+	to the names it refers to.
+	"""
+	reached = set()
+	pending = list(roots)
+
+	while pending:
+		name = pending.pop()
+
+		if name in reached:
+			continue
+
+		reached.add(name)
+		pending.extend(references.get(name, ()))
+
+	return reached
+
+def collect_structs(dwarfdump_output, roots = None, compact = False):
+	"""
+	Collects structs from the text output of `llvm-dwarfdump --debug-info`.
+
+	With `compact`, the DIEs are kept in a `store.DieStore`, which takes a fraction of the memory of
+	`DwarfDie`s, but makes collecting several times slower.
+	"""
+	with stats.phase('parse'):
+		files = parser.dwarfdump.parse(dwarfdump_output)
+
+	combine_dies = store.combine_dies if compact else _combine_dies
+
+	return collect_structs_from_units(
+		stats.timed('combine_dies', (unit for file in files for unit in combine_dies(file))),
+		roots,
+	)
+
+def _combine_dies(file):
+	"""`parser.combine_dies`, counting the DIEs combined (as `store.combine_dies` does)."""
+	address_map = {}
+
+	for cu, address_map in parser.combine_dies(file):
+		yield cu, address_map
+
+	stats.count('dies', len(address_map))
+
+def collect_structs_from_dwarfdump(paths, roots = None, compact = False):
+	"""Collects structs from the given ELF objects by running `llvm-dwarfdump` over them."""
+	with stats.phase('subprocess'):
+		output = subprocess.run(
+			['llvm-dwarfdump', '--debug-info'] + list(paths),
+			check = True,
+			stdout = subprocess.PIPE,
+			text = True,
+		).stdout
+
+	return collect_structs(output, roots, compact)
+
+def collect_structs_per_object(paths, collect = None, jobs = 1, cache = None, roots = None):
+	"""
+	Runs `collect` (by default `collect_structs_from_objects`) over each object separately, then merges
+	the results in the order the objects were given, so the result matches collecting them all at once.
+
+	Objects found in `cache` (a `cache.StructCache`) are not read again. The rest are collected in
+	`jobs` worker processes (None for one per CPU), or in this process if `jobs` is 1.
+	"""
+	collect = collect or collect_structs_from_objects
+	results = [None] * len(paths)
+	keys = [None] * len(paths)
+
+	# Every object is collected in full, and pruned to `roots` only once merged, as a struct can be
+	# reached from another object than the one defining it. Unlike collecting all objects at once, this
+	# does not skip the members of unreached structs, but it lets the cache serve any `roots`.
+	if cache is not None:
+		with stats.phase('cache'):
+			for i, path in enumerate(paths):
+				keys[i] = cache.key(path, collect)
+				results[i] = cache.get(keys[i])
+
+	missing = [i for i, result in enumerate(results) if result is None]
+
+	if jobs == 1 or len(missing) <= 1:
+		collected = [collect([paths[i]]) for i in missing]
+	else:
+		# The workers' own phases are not recorded, only the time waiting for them.
+		with stats.phase('workers'), concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+			collected = list(executor.map(collect, [[paths[i]] for i in missing]))
+
+	for i, object_structs in zip(missing, collected):
+		results[i] = object_structs
+
+	if cache is not None:
+		with stats.phase('cache'):
+			for i in missing:
+				cache.put(keys[i], results[i])
+
+			cache.evict()
+
+	structs = {}
+	origins = {}
+
+	with stats.phase('collect'):
+		for path, object_structs in zip(paths, results):
+			for struct in object_structs.values():
+				_merge_struct(structs, origins, struct, path)
+
+		if roots is not None:
+			structs = prune_unreachable(structs, roots)
+
+	return structs
+
+def collect_structs_from_objects(paths, roots = None):
+	"""Collects structs by reading the debugging info of the given ELF objects directly."""
+	return collect_structs_from_units(
+		stats.timed('read', (unit for path in paths for unit in native.read_debug_info(path))),
+		roots,
+	)
+
+# Types whose `AT_type` leads on to the type a member refers to.
+_REFERRING_TAGS = {
+	'TAG_typedef',
+	'TAG_pointer_type',
+	'TAG_array_type',
+	'TAG_const_type',
+	'TAG_volatile_type',
+	'TAG_restrict_type',
+	'TAG_atomic_type',
+}
+
+def collect_structs_from_units(units, roots = None):
+	"""
+	Collects structs from `(cu, address_map)` pairs, as returned by `parser.combine_dies` or
+	`store.combine_dies`.
+
+	With `roots` (a collection of struct names), only the named structs and those they reach are
+	collected. This takes two passes over `units`: the first one only gathers what each struct refers
+	to, and once the references of all units are known, the second one collects the members of the
+	reached structs. All units are kept in memory in between.
+
+	Structs from headers appear in every unit including them, so each struct is only collected again
+	when a cheap fingerprint of its layout differs from the one already collected under its name. If
+	the layouts really differ, `LayoutConflictError` is raised.
+	"""
 	def _resolve_typedefs(type):
 		return typedef_targets.get(type.address, type)
 
@@ -60,54 +242,179 @@ def collect_structs(dwarfdump_output):
 				type.attributes['AT_byte_size'],
 			)
 
-	def _collect_struct(die):
-		struct_name = die.attributes.get('AT_name', None)
+	def _fingerprint(die):
+		"""A key for the layout of `die` (a struct or union) that is cheaper to compute than collecting it."""
+		members = []
 
+		for member in die.children:
+			type = _resolve_typedefs(member.attributes['AT_type'].target)
+
+			if type.tag == 'TAG_union_type':
+				members.append(_fingerprint(type))
+				continue
+
+			if type.tag == 'TAG_array_type':
+				element_type = _resolve_typedefs(type.attributes['AT_type'].target)
+				element = (element_type.tag, element_type.attributes.get('AT_name'), element_type.attributes.get('AT_byte_size'))
+			else:
+				element = None
+
+			members.append((member.attributes.get('AT_name'), type.tag, type.attributes.get('AT_byte_size'), element))
+
+		return tuple(members)
+
+	def _struct_name(die):
 		if die.address in typedef_referrers:
-			struct_name = typedef_referrers[die.address][0].attributes['AT_name']
+			return typedef_referrers[die.address][0].attributes['AT_name']
+
+		return die.attributes.get('AT_name', None)
+
+	def _collect_struct(die):
+		struct_name = _struct_name(die)
 
 		members = []
 
 		for member in die.children:
 			members.append(_collect_member(member))
 
-		return struct_name, DwarfStruct(struct_name, members)
+		return struct_name, DwarfStruct(struct_name, members, addr_size, _struct_references(die))
+
+	def _referenced_structs(die):
+		"""Yields the struct DIEs that the members of `die` (a struct) refer to."""
+		pending = list(die.children)
+
+		while pending:
+			type_ref = pending.pop().attributes.get('AT_type')
+
+			while type_ref is not None:
+				type = type_ref.target
+
+				if type.tag == 'TAG_structure_type':
+					yield type
+					break
+				elif type.tag == 'TAG_union_type':
+					pending.extend(type.children)
+					break
+				elif type.tag not in _REFERRING_TAGS:
+					break
+
+				type_ref = type.attributes.get('AT_type')
+
+	def _struct_references(die):
+		"""
+		Returns the names of the structs that `die` (a struct) refers to. Anonymous structs have no
+		name to refer to them by, so what they refer to is included instead.
+		"""
+		names = set()
+		pending = [die]
+		seen = set()
+
+		while pending:
+			for target in _referenced_structs(pending.pop()):
+				if target.address in seen:
+					continue
+
+				seen.add(target.address)
+				name = _struct_name(target)
+
+				if name is None:
+					pending.append(target)
+				else:
+					names.add(name)
+
+		return frozenset(names)
 
-	def _collect_structs_from_cu(cu):
-		structs = {}
+	def _enter_cu(cu):
+		"""
+		Sets up the typedef lookups of `cu` for the helpers above, and returns its top-level structs.
+		"""
+		nonlocal addr_size, typedef_targets, typedef_referrers
+
+		assert(len(cu.children) == 1)
+		assert(cu.children[0].tag == 'TAG_compile_unit')
+
+		addr_size = cu.addr_size
+		typedef_targets = _typedef_targets(cu.children[0].children)
+		typedef_referrers = {}
 
 		for die in cu.children[0].children:
-			if die.tag != 'TAG_structure_type':
+			if die.tag == 'TAG_typedef':
+				typedef_referrers.setdefault(typedef_targets[die.address].address, []).append(die)
+
+		return [die for die in cu.children[0].children if die.tag == 'TAG_structure_type']
+
+	def _collect_structs_from_cu(cu, reached):
+		origin = cu.children[0].attributes.get('AT_name', 'unnamed unit')
+
+		for die in _enter_cu(cu):
+			name = _struct_name(die)
+
+			if reached is not None and name not in reached:
 				continue
 
-			structs.__setitem__(*_collect_struct(die))
-		
-		return structs
+			fingerprint = _fingerprint(die) if die.children else None
 
-	structs = {}
+			if fingerprint is not None and fingerprints.get(name) == fingerprint:
+				continue
 
-	result = parser.dwarfdump.parse(dwarfdump_output)
+			_merge_struct(structs, origins, _collect_struct(die)[1], origin)
 
-	for file in result:
-		for cu, address_map in parser.combine_dies(file):
-			assert(len(cu.children) == 1)
-			assert(cu.children[0].tag == 'TAG_compile_unit')
+			if fingerprint is not None and name not in fingerprints:
+				fingerprints[name] = fingerprint
 
-			typedef_referrers = {}
-			typedef_targets = {}
+	structs = {}
+	origins = {}
+	# Fingerprint of each struct collected with members, by name.
+	fingerprints = {}
 
-			for die in cu.children[0].children:
-				if die.tag != 'TAG_typedef':
-					continue
+	addr_size = None
+	typedef_targets = None
+	typedef_referrers = None
+	reached = None
 
-				target = die
+	with stats.phase('collect'):
+		if roots is not None:
+			units = [cu for cu, address_map in units]
+			references = {}
 
-				while target.tag == 'TAG_typedef':
-					target = target.attributes['AT_type'].target
+			for cu in units:
+				for die in _enter_cu(cu):
+					name = _struct_name(die)
 
-				typedef_referrers.setdefault(target.address, []).append(die)
-				typedef_targets[die.address] = target
+					if name is not None:
+						references.setdefault(name, set()).update(_struct_references(die))
+
+			reached = _reachable(references, roots)
+		else:
+			units = (cu for cu, address_map in units)
+
+		for cu in units:
+			_collect_structs_from_cu(cu, reached)
 
-			structs.update(_collect_structs_from_cu(cu))
-	
 	return structs
+
+def _typedef_targets(dies):
+	"""
+	Maps the address of each typedef in `dies` to the type at the end of its chain of typedefs. Each
+	typedef is only followed once: chains stop at the first typedef already resolved, and every typedef
+	along the way is then mapped straight to the end.
+	"""
+	targets = {}
+
+	for die in dies:
+		if die.tag != 'TAG_typedef':
+			continue
+
+		chain = []
+		target = die
+
+		while target.tag == 'TAG_typedef' and target.address not in targets:
+			chain.append(target.address)
+			target = target.attributes['AT_type'].target
+
+		target = targets.get(target.address, target)
+
+		for address in chain:
+			targets[address] = target
+
+	return targets
@@ -0,0 +1,26 @@
+## Struct layout cache
+# Maps the content hash of an object file to the structs collected from it, so that only new or
+# changed objects need their debugging info read again. Entries are pickled `DwarfStruct` dicts.
+
+import hashlib
+
+from ..cache import PickleCache, file_digest
+
+# Bump whenever the collected results for the same object could change.
+CACHE_VERSION = 3
+
+class StructCache(PickleCache):
+	name = 'struct cache'
+	# The collected structs are namedtuples.
+	memory = {}
+
+	def key(self, path, collect):
+		"""Returns the cache key for collecting structs from `path` with `collect`."""
+		# `collect` may be a `functools.partial` with options bound.
+		options = sorted(getattr(collect, 'keywords', {}).items())
+		collect = getattr(collect, 'func', collect)
+		digest = hashlib.sha256(
+			f'{CACHE_VERSION}:{collect.__module__}.{collect.__qualname__}:{options}:'.encode('utf-8')
+		)
+
+		return file_digest(path, digest).hexdigest()
@@ -0,0 +1,630 @@
+## Native DWARF reader
+# Decodes `.debug_info` directly from ELF object files, producing the same `DwarfCompilationUnit`/
+# `DwarfDie` trees as `parser.combine_dies` does from `llvm-dwarfdump` output. Only the tags and
+# attributes that `collect_structs` looks at are decoded; everything else (function bodies,
+# variables, location lists) is skipped over without building any objects.
+#
+# Handles DWARF 2-5 in 32- or 64-bit ELF relocatable objects of either endianness. Relocations
+# against the debug sections are applied as they are read, as in an unlinked object most section
+# offsets are zero until relocated.
+
+import mmap
+import struct
+import zlib
+
+from .. import stats
+from .parser import DwarfAttributeRef, DwarfCompilationUnit, DwarfDie
+
+## Constants
+SHT_SYMTAB = 2
+SHT_RELA = 4
+SHT_REL = 9
+SHF_COMPRESSED = 0x800
+ELFCOMPRESS_ZLIB = 1
+
+DW_CHILDREN_yes = 1
+
+DW_UT_compile = 0x01
+DW_UT_type = 0x02
+DW_UT_partial = 0x03
+DW_UT_skeleton = 0x04
+DW_UT_split_compile = 0x05
+DW_UT_split_type = 0x06
+
+# Tags kept in the tree; any other DIE is skipped along with all of its children.
+TAGS = {
+	0x01: 'TAG_array_type',
+	0x04: 'TAG_enumeration_type',
+	0x0d: 'TAG_member',
+	0x0f: 'TAG_pointer_type',
+	0x10: 'TAG_reference_type',
+	0x11: 'TAG_compile_unit',
+	0x13: 'TAG_structure_type',
+	0x15: 'TAG_subroutine_type',
+	0x16: 'TAG_typedef',
+	0x17: 'TAG_union_type',
+	0x21: 'TAG_subrange_type',
+	0x24: 'TAG_base_type',
+	0x26: 'TAG_const_type',
+	0x28: 'TAG_enumerator',
+	0x35: 'TAG_volatile_type',
+	0x37: 'TAG_restrict_type',
+	0x3b: 'TAG_unspecified_type',
+	0x47: 'TAG_atomic_type',
+}
+
+DW_AT_sibling = 0x01
+DW_AT_name = 0x03
+DW_AT_byte_size = 0x0b
+DW_AT_type = 0x49
+DW_AT_str_offsets_base = 0x72
+
+# Attributes kept on kept DIEs.
+ATTRIBUTES = {
+	DW_AT_name: 'AT_name',
+	DW_AT_byte_size: 'AT_byte_size',
+	DW_AT_type: 'AT_type',
+}
+
+### Forms
+# Fixed-size forms map to their size; the rest are marked with one of the following.
+_ADDR = -1
+_OFFSET = -2
+_ULEB = -3
+_SLEB = -4
+_CSTRING = -5
+_BLOCK1 = -6
+_BLOCK2 = -7
+_BLOCK4 = -8
+_BLOCK = -9
+_INDIRECT = -10
+_REF_ADDR = -11
+
+FORM_SIZES = {
+	0x01: _ADDR,      # addr
+	0x03: _BLOCK2,    # block2
+	0x04: _BLOCK4,    # block4
+	0x05: 2,          # data2
+	0x06: 4,          # data4
+	0x07: 8,          # data8
+	0x08: _CSTRING,   # string
+	0x09: _BLOCK,     # block
+	0x0a: _BLOCK1,    # block1
+	0x0b: 1,          # data1
+	0x0c: 1,          # flag
+	0x0d: _SLEB,      # sdata
+	0x0e: _OFFSET,    # strp
+	0x0f: _ULEB,      # udata
+	0x10: _REF_ADDR,  # ref_addr
+	0x11: 1,          # ref1
+	0x12: 2,          # ref2
+	0x13: 4,          # ref4
+	0x14: 8,          # ref8
+	0x15: _ULEB,      # ref_udata
+	0x16: _INDIRECT,  # indirect
+	0x17: _OFFSET,    # sec_offset
+	0x18: _BLOCK,     # exprloc
+	0x19: 0,          # flag_present
+	0x1a: _ULEB,      # strx
+	0x1b: _ULEB,      # addrx
+	0x1c: 4,          # ref_sup4
+	0x1d: _OFFSET,    # strp_sup
+	0x1e: 16,         # data16
+	0x1f: _OFFSET,    # line_strp
+	0x20: 8,          # ref_sig8
+	0x21: 0,          # implicit_const
+	0x22: _ULEB,      # loclistx
+	0x23: _ULEB,      # rnglistx
+	0x24: 8,          # ref_sup8
+	0x25: 1,          # strx1
+	0x26: 2,          # strx2
+	0x27: 3,          # strx3
+	0x28: 4,          # strx4
+	0x29: 1,          # addrx1
+	0x2a: 2,          # addrx2
+	0x2b: 3,          # addrx3
+	0x2c: 4,          # addrx4
+	0x1f01: _ULEB,    # GNU_addr_index
+	0x1f02: _ULEB,    # GNU_str_index
+	0x1f20: _OFFSET,  # GNU_ref_alt
+	0x1f21: _OFFSET,  # GNU_strp_alt
+}
+
+DW_FORM_string = 0x08
+DW_FORM_strp = 0x0e
+DW_FORM_line_strp = 0x1f
+DW_FORM_implicit_const = 0x21
+DW_FORM_ref_udata = 0x15
+DW_FORM_ref_addr = 0x10
+DW_FORM_sdata = 0x0d
+_REF_FORMS = {0x11, 0x12, 0x13, 0x14, DW_FORM_ref_udata}
+_STRX_FORMS = {0x1a, 0x25, 0x26, 0x27, 0x28}
+_SIGNED_FORMS = {DW_FORM_sdata}
+
+## Low-level readers
+def _uleb(data, pos):
+	result = 0
+	shift = 0
+
+	while True:
+		byte = data[pos]
+		pos += 1
+		result |= (byte & 0x7f) << shift
+		shift += 7
+
+		if byte < 0x80:
+			return result, pos
+
+def _sleb(data, pos):
+	result = 0
+	shift = 0
+
+	while True:
+		byte = data[pos]
+		pos += 1
+		result |= (byte & 0x7f) << shift
+		shift += 7
+
+		if byte < 0x80:
+			if byte & 0x40:
+				result -= 1 << shift
+
+			return result, pos
+
+def _cstring(buffer, pos):
+	end = buffer.find(b'\0', pos)
+
+	return bytes(buffer[pos:end]).decode('utf-8', 'replace'), end + 1
+
+class _Section:
+	def __init__(self, buffer, base, size, endian):
+		# `buffer` is the mmap (or decompressed bytes) the section lives in; `data` is a view of just
+		# the section, for indexing. `buffer` is kept for its `find`, which memoryviews lack.
+		self.buffer = buffer
+		self.base = base
+		self.data = memoryview(buffer)[base:base + size]
+		self.endian = endian
+		self.relocations = {}
+
+	def release(self):
+		self.data.release()
+
+	def find_nul(self, pos):
+		return self.buffer.find(b'\0', self.base + pos) - self.base
+
+	def uint(self, pos, size):
+		value = int.from_bytes(self.data[pos:pos + size], self.endian)
+		relocation = self.relocations.get(pos)
+
+		if relocation is not None:
+			base, addend = relocation
+			value = base + (value if addend is None else addend)
+
+		return value
+
+	def string(self, pos):
+		return _cstring(self.buffer, self.base + pos)[0]
+
+	def cstring(self, pos):
+		value, end = _cstring(self.buffer, self.base + pos)
+
+		return value, end - self.base
+
+## ELF
+class ElfObject:
+	def __init__(self, path):
+		self._file = open(path, 'rb')
+
+		try:
+			self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+		except ValueError:
+			# Empty files can't be mapped.
+			self._map = b''
+
+		data = self._map
+
+		if data[:4] != b'\x7fELF':
+			raise ValueError(f'{path}: not an ELF file')
+
+		self.is_64 = data[4] == 2
+		self.endian = '<' if data[5] == 1 else '>'
+		self.byteorder = 'little' if data[5] == 1 else 'big'
+
+		e = self.endian
+
+		if self.is_64:
+			shoff, = struct.unpack_from(e + 'Q', data, 0x28)
+			shentsize, shnum, shstrndx = struct.unpack_from(e + 'HHH', data, 0x3a)
+			sh_format = e + 'IIQQQQIIQQ'
+		else:
+			shoff, = struct.unpack_from(e + 'I', data, 0x20)
+			shentsize, shnum, shstrndx = struct.unpack_from(e + 'HHH', data, 0x2e)
+			sh_format = e + 'IIIIIIIIII'
+
+		def _section_header(i):
+			return struct.unpack_from(sh_format, data, shoff + i * shentsize)
+
+		if shoff and shnum == 0:
+			shnum = _section_header(0)[5]
+
+		if shstrndx == 0xffff:
+			shstrndx = _section_header(0)[6]
+
+		# (name, type, flags, addr, offset, size, link, info, addralign, entsize)
+		self.section_headers = [_section_header(i) for i in range(shnum)]
+		names_offset = self.section_headers[shstrndx][4] if shnum else 0
+		self.section_names = [_cstring(data, names_offset + sh[0])[0] for sh in self.section_headers]
+		self.sections_by_name = {name: i for i, name in enumerate(self.section_names)}
+
+		self._symbol_values = {}
+
+	def close(self):
+		if isinstance(self._map, mmap.mmap):
+			self._map.close()
+
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _raw_section(self, i):
+		"""Returns `(buffer, base, size)` locating the contents of section `i`."""
+		_, _, flags, _, offset, size, _, _, _, _ = self.section_headers[i]
+
+		if flags & SHF_COMPRESSED:
+			if self.is_64:
+				ch_type, _, ch_size, _ = struct.unpack_from(self.endian + 'IIQQ', self._map, offset)
+				header_size = 24
+			else:
+				ch_type, ch_size, _ = struct.unpack_from(self.endian + 'III', self._map, offset)
+				header_size = 12
+
+			if ch_type != ELFCOMPRESS_ZLIB:
+				raise ValueError(f'unsupported compression type {ch_type} in {self.section_names[i]}')
+
+			return zlib.decompress(self._map[offset + header_size:offset + size]), 0, ch_size
+
+		return self._map, offset, size
+
+	def _raw_bytes(self, i):
+		buffer, base, size = self._raw_section(i)
+
+		return buffer[base:base + size]
+
+	def section_contents(self, i):
+		"""Returns the contents of section `i`, decompressed if need be."""
+		return bytes(self._raw_bytes(i))
+
+	def _symbols(self, symtab_index):
+		if symtab_index in self._symbol_values:
+			return self._symbol_values[symtab_index]
+
+		data = self._raw_bytes(symtab_index)
+
+		if self.is_64:
+			sym_format, sym_size, value_index = self.endian + 'IBBHQQ', 24, 4
+		else:
+			sym_format, sym_size, value_index = self.endian + 'IIIBBH', 16, 1
+
+		values = [
+			entry[value_index]
+			for entry
+			in struct.iter_unpack(sym_format, data[:len(data) - len(data) % sym_size])
+		]
+		self._symbol_values[symtab_index] = values
+
+		return values
+
+	def section(self, name):
+		"""Returns a `_Section` for the named section with its relocations applied, or None."""
+		i = self.sections_by_name.get(name)
+
+		if i is None:
+			return None
+
+		result = _Section(*self._raw_section(i), self.byteorder)
+
+		for j, (_, sh_type, _, _, _, _, link, info, _, _) in enumerate(self.section_headers):
+			if sh_type not in (SHT_RELA, SHT_REL) or info != i:
+				continue
+
+			symbols = self._symbols(link)
+			data = self._raw_bytes(j)
+
+			if self.is_64:
+				if sh_type == SHT_RELA:
+					entries = ((o, x >> 32, a) for o, x, a in struct.iter_unpack(self.endian + 'QQq', data))
+				else:
+					entries = ((o, x >> 32, None) for o, x in struct.iter_unpack(self.endian + 'QQ', data))
+			else:
+				if sh_type == SHT_RELA:
+					entries = ((o, x >> 8, a) for o, x, a in struct.iter_unpack(self.endian + 'IIi', data))
+				else:
+					entries = ((o, x >> 8, None) for o, x in struct.iter_unpack(self.endian + 'II', data))
+
+			# All relocations in debug sections are absolute, so S + A is all we need.
+			for offset, symbol, addend in entries:
+				result.relocations[offset] = (symbols[symbol], addend)
+
+		return result
+
+## DWARF
+def _read_abbrevs(debug_abbrev, offset):
+	data = debug_abbrev.data
+	abbrevs = {}
+
+	while True:
+		code, offset = _uleb(data, offset)
+
+		if code == 0:
+			return abbrevs
+
+		tag, offset = _uleb(data, offset)
+		has_children = data[offset] == DW_CHILDREN_yes
+		offset += 1
+
+		attributes = []
+
+		while True:
+			name, offset = _uleb(data, offset)
+			form, offset = _uleb(data, offset)
+
+			if name == 0 and form == 0:
+				break
+
+			implicit_const = None
+
+			if form == DW_FORM_implicit_const:
+				implicit_const, offset = _sleb(data, offset)
+
+			attributes.append((name, form, implicit_const))
+
+		abbrevs[code] = (tag, has_children, attributes)
+
+class _Unit:
+	"""Per-unit decoding state."""
+
+	def __init__(self, sections, offset, version, offset_size, addr_size, die_offset, end):
+		self.sections = sections
+		self.offset = offset
+		self.version = version
+		self.offset_size = offset_size
+		self.addr_size = addr_size
+		self.die_offset = die_offset
+		self.end = end
+		self.str_offsets_base = 8 if offset_size == 4 else 16
+
+	def skip_form(self, data, pos, form):
+		size = FORM_SIZES[form]
+
+		if size >= 0:
+			return pos + size
+		elif size == _ULEB or size == _SLEB:
+			while data[pos] & 0x80:
+				pos += 1
+			return pos + 1
+		elif size == _OFFSET:
+			return pos + self.offset_size
+		elif size == _ADDR:
+			return pos + self.addr_size
+		elif size == _REF_ADDR:
+			return pos + (self.addr_size if self.version <= 2 else self.offset_size)
+		elif size == _CSTRING:
+			return self.sections.debug_info.find_nul(pos) + 1
+		elif size == _BLOCK1:
+			return pos + 1 + data[pos]
+		elif size == _BLOCK2:
+			return pos + 2 + int.from_bytes(data[pos:pos + 2], self.sections.debug_info.endian)
+		elif size == _BLOCK4:
+			return pos + 4 + int.from_bytes(data[pos:pos + 4], self.sections.debug_info.endian)
+		elif size == _BLOCK:
+			length, pos = _uleb(data, pos)
+			return pos + length
+		elif size == _INDIRECT:
+			form, pos = _uleb(data, pos)
+			return self.skip_form(data, pos, form)
+
+	def read_form(self, pos, form, implicit_const):
+		"""Returns `(value, new_pos)` for the attribute value at `pos`."""
+		debug_info = self.sections.debug_info
+		data = debug_info.data
+		size = FORM_SIZES[form]
+
+		if form == DW_FORM_implicit_const:
+			return implicit_const, pos
+		elif form == DW_FORM_string:
+			return debug_info.cstring(pos)
+		elif form == DW_FORM_strp:
+			return self.sections.debug_str.string(debug_info.uint(pos, self.offset_size)), pos + self.offset_size
+		elif form == DW_FORM_line_strp:
+			return self.sections.debug_line_str.string(debug_info.uint(pos, self.offset_size)), pos + self.offset_size
+		elif form in _STRX_FORMS:
+			if size == _ULEB:
+				index, pos = _uleb(data, pos)
+			else:
+				index, pos = int.from_bytes(data[pos:pos + size], debug_info.endian), pos + size
+
+			str_offsets = self.sections.debug_str_offsets
+			offset = str_offsets.uint(self.str_offsets_base + index * self.offset_size, self.offset_size)
+
+			return self.sections.debug_str.string(offset), pos
+		elif form in _REF_FORMS:
+			if size == _ULEB:
+				value, pos = _uleb(data, pos)
+			else:
+				value, pos = int.from_bytes(data[pos:pos + size], debug_info.endian), pos + size
+
+			return DwarfAttributeRef(self.offset + value, self.sections.address_map), pos
+		elif form == DW_FORM_ref_addr:
+			size = self.addr_size if self.version <= 2 else self.offset_size
+
+			return DwarfAttributeRef(debug_info.uint(pos, size), self.sections.address_map), pos + size
+		elif form in _SIGNED_FORMS:
+			return _sleb(data, pos)
+		elif size == _ULEB:
+			return _uleb(data, pos)
+		elif size > 0 and size <= 8:
+			return debug_info.uint(pos, size), pos + size
+		elif size == _INDIRECT:
+			form, pos = _uleb(data, pos)
+			return self.read_form(pos, form, None)
+		else:
+			# Not needed by anything that reads these trees.
+			return None, self.skip_form(data, pos, form)
+
+class _Sections:
+	def __init__(self, elf):
+		self.debug_info = elf.section('.debug_info')
+		self.debug_abbrev = elf.section('.debug_abbrev')
+		self.debug_str = elf.section('.debug_str')
+		self.debug_line_str = elf.section('.debug_line_str')
+		self.debug_str_offsets = elf.section('.debug_str_offsets')
+		self.address_map = {}
+
+	def release(self):
+		for section in (self.debug_info, self.debug_abbrev, self.debug_str, self.debug_line_str, self.debug_str_offsets):
+			if section is not None:
+				section.release()
+
+def _read_units(sections):
+	debug_info = sections.debug_info
+	data = debug_info.data
+	offset = 0
+
+	while offset < len(data):
+		unit_length = debug_info.uint(offset, 4)
+		offset_size = 4
+		header = offset + 4
+
+		if unit_length == 0xffffffff:
+			unit_length = debug_info.uint(header, 8)
+			offset_size = 8
+			header += 8
+
+		end = header + unit_length
+		version = debug_info.uint(header, 2)
+		header += 2
+
+		if version >= 5:
+			unit_type = data[header]
+			addr_size = data[header + 1]
+			abbrev_offset = debug_info.uint(header + 2, offset_size)
+			header += 2 + offset_size
+
+			if unit_type in (DW_UT_skeleton, DW_UT_split_compile):
+				header += 8
+			elif unit_type in (DW_UT_type, DW_UT_split_type):
+				header += 8 + offset_size
+		else:
+			unit_type = DW_UT_compile
+			abbrev_offset = debug_info.uint(header, offset_size)
+			addr_size = data[header + offset_size]
+			header += offset_size + 1
+
+		if unit_type in (DW_UT_compile, DW_UT_partial):
+			yield _Unit(sections, offset, version, offset_size, addr_size, header, end), abbrev_offset
+
+		offset = end
+
+def _read_dies(unit, abbrevs):
+	"""Returns the unit's DIEs as a `DwarfCompilationUnit`, skipping any not in `TAGS`."""
+	data = unit.sections.debug_info.data
+	address_map = unit.sections.address_map
+	pos = unit.die_offset
+	end = unit.end
+
+	result = DwarfCompilationUnit(addr_size = unit.addr_size, children = [])
+
+	# The stack holds the children list for each open, kept DIE, or None for skipped ones.
+	stack = [result.children]
+
+	while pos < end:
+		address = pos
+		code, pos = _uleb(data, pos)
+
+		if code == 0:
+			stack.pop()
+
+			if not stack:
+				break
+
+			continue
+
+		tag, has_children, attributes = abbrevs[code]
+		tag_name = TAGS.get(tag)
+		parent = stack[-1]
+
+		if tag_name is None or parent is None:
+			sibling = None
+
+			for name, form, _ in attributes:
+				if name == DW_AT_sibling and form in _REF_FORMS:
+					sibling, pos = unit.read_form(pos, form, None)
+				else:
+					pos = unit.skip_form(data, pos, form)
+
+			if has_children:
+				if sibling is not None:
+					pos = sibling.address
+				else:
+					stack.append(None)
+
+			continue
+
+		die_attributes = {}
+
+		for name, form, implicit_const in attributes:
+			key = ATTRIBUTES.get(name)
+
+			if key is None:
+				if name == DW_AT_str_offsets_base:
+					unit.str_offsets_base, pos = unit.read_form(pos, form, implicit_const)
+				else:
+					pos = unit.skip_form(data, pos, form)
+
+				continue
+
+			die_attributes[key], pos = unit.read_form(pos, form, implicit_const)
+
+		die = DwarfDie(
+			address = address,
+			tag = tag_name,
+			attributes = die_attributes,
+			children = [],
+		)
+		address_map[address] = die
+		parent.append(die)
+
+		if has_children:
+			stack.append(die.children)
+
+	return result
+
+def read_debug_info(path):
+	"""
+	Yields `(cu, address_map)` for each compilation unit in the ELF object at `path`, in the same shape
+	as `parser.combine_dies`.
+	"""
+	with ElfObject(path) as elf:
+		sections = _Sections(elf)
+
+		try:
+			if sections.debug_info is None:
+				return
+
+			abbrev_cache = {}
+
+			for unit, abbrev_offset in _read_units(sections):
+				if abbrev_offset not in abbrev_cache:
+					abbrev_cache[abbrev_offset] = _read_abbrevs(sections.debug_abbrev, abbrev_offset)
+
+				yield _read_dies(unit, abbrev_cache[abbrev_offset]), sections.address_map
+
+			# Only the DIEs kept are counted: those with tags in `TAGS`, under kept parents.
+			stats.count('dies', len(sections.address_map))
+		finally:
+			# The mmap can't be closed while views into it are still alive.
+			sections.release()
@@ -63,7 +63,7 @@ def dwarfdump():
 
 	quoted_string = p.string('"') >> p.regex(r'[^"]*') << p.string('"')
 	hex_number = p.regex(r'0x[0-9a-fA-F]+').map(lambda x: int(x, 0)).desc('hex number')
-	decimal_number = p.regex(r'-?[0-9]+').map(lambda x: int(x, 0)).desc('decimal number')
+	decimal_number = p.regex(r'[-+]?[0-9]+').map(lambda x: int(x, 0)).desc('decimal number')
 	boolean = (p.string('true') | p.string('false')).map(lambda b: b == 'true').desc('boolean')
 	dwarf_code = p.string('DW_') >> p.regex(r'\w+')
 
@@ -113,7 +113,9 @@ def combine_dies(file):
 
 			if raw_die.indent > (len(stack) - 1):
 				stack.append(stack[-1].children[-1])
-			elif raw_die.indent < (len(stack) - 1):
+
+			# A DIE can close several levels of nesting at once.
+			while raw_die.indent < (len(stack) - 1):
 				stack.pop()
 
 			die = DwarfDie(
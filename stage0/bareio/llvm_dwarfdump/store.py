@@ -0,0 +1,251 @@
+## Compact DIE store
+# `parser.combine_dies` builds a `DwarfDie`, with its own attribute dict and children list, for every
+# DIE, and a `DwarfAttributeRef` carrying the whole address map for every reference. `DieStore` keeps
+# the same trees in columns instead: one array entry per DIE for its address, interned tag and its
+# parent, first child and next sibling, plus one entry per attribute for its interned name and pooled
+# value. `DieView`s give `DwarfDie`-like access to it, and are only made as the tree is read, so
+# `collect_structs` works on either.
+
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+from .. import stats
+from .parser import DwarfCompilationUnit, _DwarfRawAttributeRef
+
+NO_DIE = -1
+
+class _Interner:
+	"""Assigns small ids to values, in order of first appearance."""
+
+	def __init__(self):
+		self.ids = {}
+		self.values = []
+
+	def intern(self, value, key = None):
+		key = value if key is None else key
+
+		try:
+			return self.ids[key]
+		except KeyError:
+			id = self.ids[key] = len(self.values)
+			self.values.append(value)
+
+			return id
+
+class DieStore:
+	"""
+	DIEs in columns, indexed from 0 in the order they were added. Addresses must be added in
+	increasing order, as they are looked up by bisection.
+
+	Attribute values are ids in `values`, except for references, which are stored as `-1 - address`
+	and resolved when read, so they may point at DIEs added later.
+	"""
+
+	def __init__(self):
+		self.addresses = array('Q')
+		self.tag_ids = array('i')
+		self.parents = array('i')
+		self.first_children = array('i')
+		self.next_siblings = array('i')
+		# DIE i's attributes are entries attribute_starts[i] to attribute_starts[i + 1].
+		self.attribute_starts = array('I', [0])
+		self.attribute_names = array('i')
+		self.attribute_values = array('q')
+
+		self.tags = _Interner()
+		self.names = _Interner()
+		self.values = _Interner()
+
+	def __len__(self):
+		return len(self.addresses)
+
+	def add(self, address, tag, attributes, parent = NO_DIE, previous_sibling = NO_DIE):
+		"""Adds a DIE after `previous_sibling` among `parent`'s children, and returns its index."""
+		index = len(self.addresses)
+
+		if index and address <= self.addresses[-1]:
+			raise ValueError(f'DIE at 0x{address:08x} added after 0x{self.addresses[-1]:08x}')
+
+		self.addresses.append(address)
+		self.tag_ids.append(self.tags.intern(tag))
+		self.parents.append(parent)
+		self.first_children.append(NO_DIE)
+		self.next_siblings.append(NO_DIE)
+
+		if previous_sibling != NO_DIE:
+			self.next_siblings[previous_sibling] = index
+		elif parent != NO_DIE:
+			self.first_children[parent] = index
+
+		for name, value in attributes.items():
+			self.attribute_names.append(self.names.intern(name))
+
+			if isinstance(value, _DwarfRawAttributeRef):
+				self.attribute_values.append(-1 - value.address)
+			else:
+				# Keyed on type too, so that True and 1 stay apart.
+				self.attribute_values.append(self.values.intern(value, (type(value), value)))
+
+		self.attribute_starts.append(len(self.attribute_names))
+
+		return index
+
+	def index_of(self, address):
+		index = bisect_left(self.addresses, address)
+
+		if index == len(self.addresses) or self.addresses[index] != address:
+			raise KeyError(address)
+
+		return index
+
+	def attribute_value(self, value):
+		if value < 0:
+			return StoreRef(self, -1 - value)
+
+		return self.values.values[value]
+
+	@property
+	def address_map(self):
+		return _AddressMap(self)
+
+class DieView:
+	"""A DIE in a `DieStore`, with the same fields as `DwarfDie`."""
+
+	__slots__ = ('store', 'index')
+
+	def __init__(self, store, index):
+		self.store = store
+		self.index = index
+
+	@property
+	def address(self):
+		return self.store.addresses[self.index]
+
+	@property
+	def tag(self):
+		return self.store.tags.values[self.store.tag_ids[self.index]]
+
+	@property
+	def attributes(self):
+		return _Attributes(self.store, self.index)
+
+	@property
+	def children(self):
+		return list(self._iter_children())
+
+	def _iter_children(self):
+		store = self.store
+		child = store.first_children[self.index]
+
+		while child != NO_DIE:
+			yield DieView(store, child)
+			child = store.next_siblings[child]
+
+	def __eq__(self, other):
+		return isinstance(other, DieView) and self.store is other.store and self.index == other.index
+
+	def __hash__(self):
+		return hash((id(self.store), self.index))
+
+	def __repr__(self):
+		return f'DieView(address = 0x{self.address:08x}, tag = {self.tag!r}, attributes = {dict(self.attributes)!r})'
+
+class StoreRef:
+	"""A reference attribute, like `DwarfAttributeRef`."""
+
+	__slots__ = ('store', 'address')
+
+	def __init__(self, store, address):
+		self.store = store
+		self.address = address
+
+	@property
+	def target(self):
+		return DieView(self.store, self.store.index_of(self.address))
+
+	def __repr__(self):
+		return f'StoreRef(address = {self.address!r})'
+
+class _Attributes(Mapping):
+	__slots__ = ('store', 'start', 'end')
+
+	def __init__(self, store, index):
+		self.store = store
+		self.start = store.attribute_starts[index]
+		self.end = store.attribute_starts[index + 1]
+
+	def __getitem__(self, name):
+		store = self.store
+		id = store.names.ids.get(name)
+
+		if id is not None:
+			for i in range(self.start, self.end):
+				if store.attribute_names[i] == id:
+					return store.attribute_value(store.attribute_values[i])
+
+		raise KeyError(name)
+
+	def __iter__(self):
+		names = self.store.names.values
+
+		for i in range(self.start, self.end):
+			yield names[self.store.attribute_names[i]]
+
+	def __len__(self):
+		return self.end - self.start
+
+class _AddressMap(Mapping):
+	"""Maps addresses to `DieView`s, like the address map from `parser.combine_dies`."""
+
+	def __init__(self, store):
+		self.store = store
+
+	def __getitem__(self, address):
+		return DieView(self.store, self.store.index_of(address))
+
+	def __iter__(self):
+		return iter(self.store.addresses)
+
+	def __len__(self):
+		return len(self.store)
+
+def combine_dies(file):
+	"""
+	Like `parser.combine_dies`, but stores the DIEs of all of `file`'s units in one `DieStore`, and
+	yields `(cu, address_map)` with `DieView`s in place of `DwarfDie`s.
+	"""
+	store = DieStore()
+	units = []
+
+	for cu in file:
+		roots = []
+		# [index, last child] of each open DIE, under a placeholder for the unit.
+		stack = [[NO_DIE, NO_DIE]]
+
+		for raw_die in cu.children:
+			if raw_die.tag == 'NULL':
+				continue
+
+			if raw_die.indent > len(stack) - 1:
+				stack.append([stack[-1][1], NO_DIE])
+
+			while raw_die.indent < len(stack) - 1:
+				stack.pop()
+
+			parent = stack[-1]
+			index = store.add(raw_die.address, raw_die.tag, raw_die.attributes, parent[0], parent[1])
+			parent[1] = index
+
+			if parent[0] == NO_DIE:
+				roots.append(index)
+
+		units.append((cu.addr_size, roots))
+
+	# References can point forwards, even into later units, so nothing is handed out until all of the
+	# file is stored.
+	address_map = store.address_map
+	stats.count('dies', len(store))
+
+	for addr_size, roots in units:
+		yield DwarfCompilationUnit(addr_size = addr_size, children = [DieView(store, root) for root in roots]), address_map
@@ -1,5 +1,8 @@
 from collections import namedtuple
 from parsy import *
+import re
+
+from .utils import walk_tree
 
 def lexeme(p):
     """
@@ -11,18 +14,16 @@ def lexeme(p):
     return regex(r'[ \t]*') >> p << regex(r'[ \t]*')
 
 class ASTNode:
+	_is_container = False
+
 	def walk(self, handlers, *args):
-		for type, handler in handlers.items():
-			if isinstance(self, type):
-				return handler(self, *args)
+		return walk_tree(self, handlers, _walk_children, *args)
 
 class ASTContainerNode(ASTNode):
-	def walk(self, handlers, *args):
-		return super().walk(
-			handlers,
-			[child.walk(handlers, *args) for child in self.children],
-			*args,
-		)
+	_is_container = True
+
+def _walk_children(node):
+	return node.children if node._is_container else None
 
 class Script(ASTContainerNode, namedtuple('Script', ['children'])):
 	pass
@@ -61,10 +62,108 @@ _message = lexeme(alt(
 	_reset_context,
 ))
 
+## Hand-written parser
+# Produces the same AST as `script`, but in one pass over the input: a regex scanner splits it into
+# tokens, and argument lists are tracked on an explicit stack, so nesting depth costs heap rather
+# than Python stack. Messages also get the offset of their token in the input as `position`, which
+# isn't a field, so it doesn't affect comparisons with `script`'s AST.
+#
+# The alternatives of `_token_pattern` are tried in the same order as those of `_message`, so an
+# unterminated string becomes a name and `12ab` an integer followed by a name, just as in `script`.
+
+_token_pattern = re.compile(
+	r'(?P<string>"[^"]*")|'
+	r'(?P<integer>-?(?:0|[1-9][0-9]*))|'
+	r'(?P<name>[^ \t\n\r(),]+)|'
+	r'(?P<newline>\n)|'
+	r'(?P<open>\()|'
+	r'(?P<comma>,)|'
+	r'(?P<close>\))|'
+	r'(?P<space>[ \t]+)'
+)
+
+def tokenize(text):
+	"""Yields `(kind, value, position)` for each token in `text`, skipping whitespace."""
+	match = _token_pattern.match
+	pos = 0
+	end = len(text)
+
+	while pos < end:
+		m = match(text, pos)
+
+		if m is None:
+			raise ParseError(frozenset({'token'}), text, pos)
+
+		kind = m.lastgroup
+
+		if kind != 'space':
+			yield kind, m.group(), pos
+
+		pos = m.end()
+
+def _at(node, position):
+	node.position = position
+
+	return node
+
+def parse(text):
+	"""Parses a script, giving the same result as `script.parse(text)`."""
+	messages = []
+	result = Script(messages)
+	# Each open argument list saves the enclosing `(messages, arguments)`.
+	stack = []
+	arguments = None
+	# The named message a following '(' opens the arguments of.
+	last_name = None
+
+	for kind, value, pos in tokenize(text):
+		if kind == 'name':
+			last_name = _at(NamedMessage(value, []), pos)
+			messages.append(last_name)
+			continue
+
+		if kind == 'string':
+			messages.append(_at(String(value[1:-1]), pos))
+		elif kind == 'integer':
+			messages.append(_at(Integer(int(value)), pos))
+		elif kind == 'newline':
+			messages.append(_at(ResetContext(), pos))
+		elif kind == 'open':
+			if last_name is None:
+				raise ParseError(frozenset({'message'}), text, pos)
+
+			stack.append((messages, arguments))
+			arguments = last_name.children
+			messages = []
+			arguments.append(Script(messages))
+		elif kind == 'comma':
+			if not stack:
+				raise ParseError(frozenset({'message'}), text, pos)
+
+			messages = []
+			arguments.append(Script(messages))
+		elif kind == 'close':
+			if not stack:
+				raise ParseError(frozenset({'message'}), text, pos)
+
+			messages, arguments = stack.pop()
+
+		last_name = None
+
+	if stack:
+		raise ParseError(frozenset({"')'"}), text, len(text))
+
+	# Whitespace is only consumed around a message, so input that is nothing but whitespace is an
+	# error.
+	if text and not result.children:
+		raise ParseError(frozenset({'message'}), text, 0)
+
+	return result
+
 if __name__ == '__main__':
 	import sys
 
-	ast = script.parse(sys.stdin.read())
+	ast = parse(sys.stdin.read())
 
 	print(ast)
 
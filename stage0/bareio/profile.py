@@ -0,0 +1,69 @@
+## Message profiles
+# With `compiler.py --profile MAP`, every message in the builtin image counts how often it runs, and
+# the `halt` builtin dumps the counts over the UART, framed as:
+#
+#     BAREIO-PROFILE-BEGIN <number of counted messages>
+#     <index> <count>
+#     ...
+#     BAREIO-PROFILE-END
+#
+# with a line for each message that ran. Indices are into the compiler's profile map, a JSON object
+# whose `messages` list gives the source position of each counted message.
+
+import json
+import re
+
+MAP_VERSION = 1
+
+FRAME_BEGIN = 'BAREIO-PROFILE-BEGIN'
+FRAME_END = 'BAREIO-PROFILE-END'
+
+_frame_pattern = re.compile(
+	rf'^{FRAME_BEGIN} (\d+)\r?\n((?:\d+ \d+\r?\n)*){FRAME_END}\r?$',
+	re.MULTILINE,
+)
+
+class ProfileError(Exception):
+	pass
+
+def write_map(f, messages):
+	"""Writes a profile map for `messages`, a list of `(source, line, column, message)`."""
+	json.dump(
+		{
+			'version': MAP_VERSION,
+			'messages': [
+				{'source': source, 'line': line, 'column': column, 'message': message}
+				for source, line, column, message in messages
+			],
+		},
+		f,
+		indent = '\t',
+	)
+	f.write('\n')
+
+def read_map(f):
+	result = json.load(f)
+
+	if result.get('version') != MAP_VERSION:
+		raise ProfileError(f'unsupported profile map version: {result.get("version")!r}')
+
+	return result['messages']
+
+def parse_log(text):
+	"""
+	Returns `(message_count, counts)` from the last complete profile dump in `text` (for instance, a
+	captured serial log), where `counts` maps message indices to counts.
+	"""
+	frames = list(_frame_pattern.finditer(text))
+
+	if not frames:
+		raise ProfileError('no profile dump found')
+
+	frame = frames[-1]
+	counts = {}
+
+	for line in frame.group(2).splitlines():
+		index, count = line.split()
+		counts[int(index)] = int(count)
+
+	return int(frame.group(1)), counts
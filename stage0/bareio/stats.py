@@ -0,0 +1,175 @@
+## Build statistics
+# With `--stats FILE` (or `BAREIO_STATS=FILE` in the environment), each stage0 tool appends one line
+# of JSON to FILE when it finishes, recording where its time and memory went:
+#
+#     {"version": 1, "tool": "compiler.py", "argv": [...], "time": <start, in seconds since the epoch>,
+#      "seconds": <wall time>, "phases": {"parse": <seconds>, ...}, "counts": {"ast_nodes": ..., ...},
+#      "peak_traced_bytes": ..., "max_rss_bytes": ...}
+#
+# Phase times are exclusive: time spent in a phase nested inside another (such as DIEs being read
+# while structs are collected from them) only counts towards the inner one, so the phases add up to
+# at most the wall time. Peak memory is traced with `tracemalloc` from when recording starts, which
+# slows the tool down; `max_rss_bytes` is the peak resident size of the whole process (for the stage0
+# daemon, over its whole life).
+#
+# Library code records into the current recorder through the module-level functions, which do
+# nothing unless a tool has started recording.
+
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+RECORD_VERSION = 1
+
+ENVIRONMENT_VARIABLE = 'BAREIO_STATS'
+
+class Stats:
+	def __init__(self, tool, path):
+		self.tool = tool
+		self.path = path
+		self.argv = list(sys.argv[1:])
+		self.phases = {}
+		self.counts = {}
+
+		# [name, time the phase last resumed] of each open phase, innermost last.
+		self._open = []
+
+		self.time = time.time()
+		self._start = time.perf_counter()
+
+		tracemalloc.start()
+
+	def enter(self, name):
+		now = time.perf_counter()
+
+		if self._open:
+			self._charge(self._open[-1], now)
+
+		self._open.append([name, now])
+
+	def exit(self):
+		now = time.perf_counter()
+		self._charge(self._open.pop(), now)
+
+		if self._open:
+			self._open[-1][1] = now
+
+	def _charge(self, phase, now):
+		name, resumed = phase
+		self.phases[name] = self.phases.get(name, 0) + now - resumed
+
+	@contextlib.contextmanager
+	def phase(self, name):
+		self.enter(name)
+
+		try:
+			yield
+		finally:
+			self.exit()
+
+	def timed(self, name, iterable):
+		"""Yields from `iterable`, counting the time taken to produce each item towards phase `name`."""
+		iterator = iter(iterable)
+
+		while True:
+			self.enter(name)
+
+			try:
+				item = next(iterator)
+			except StopIteration:
+				return
+			finally:
+				self.exit()
+
+			yield item
+
+	def count(self, name, n = 1):
+		self.counts[name] = self.counts.get(name, 0) + n
+
+	def record(self):
+		_, peak = tracemalloc.get_traced_memory()
+
+		return {
+			'version': RECORD_VERSION,
+			'tool': self.tool,
+			'argv': self.argv,
+			'time': self.time,
+			'seconds': time.perf_counter() - self._start,
+			'phases': self.phases,
+			'counts': self.counts,
+			'peak_traced_bytes': peak,
+			# In kilobytes on Linux.
+			'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+		}
+
+	def write(self):
+		line = json.dumps(self.record()) + '\n'
+		tracemalloc.stop()
+
+		# A single append, so the records of tools running in parallel don't interleave.
+		with open(self.path, 'a', encoding = 'utf-8') as f:
+			f.write(line)
+
+class _NoStats:
+	"""Stands in for `Stats` while nothing is being recorded."""
+
+	def phase(self, name):
+		return contextlib.nullcontext()
+
+	def timed(self, name, iterable):
+		return iterable
+
+	def count(self, name, n = 1):
+		pass
+
+_NO_STATS = _NoStats()
+
+current = _NO_STATS
+
+def add_option(arg_parser):
+	arg_parser.add_argument(
+		'--stats',
+		metavar = 'FILE',
+		default = os.environ.get(ENVIRONMENT_VARIABLE) or None,
+		help = 'append a JSON record of the time spent in each phase, item counts and peak memory to '
+			f'FILE (default: ${ENVIRONMENT_VARIABLE}, if set)',
+	)
+
+def start(tool, path):
+	"""Starts recording statistics for `tool`, to be appended to `path` by `finish`, if `path` is set."""
+	global current
+
+	current = Stats(tool, os.path.abspath(path)) if path else _NO_STATS
+
+def finish():
+	"""Writes the statistics being recorded, if any, and stops recording."""
+	global current
+
+	if current is not _NO_STATS:
+		stats, current = current, _NO_STATS
+		stats.write()
+
+def discard():
+	"""Stops recording without writing anything, for a tool that failed or exited early."""
+	global current
+
+	if current is not _NO_STATS:
+		current = _NO_STATS
+		tracemalloc.stop()
+
+def enabled():
+	return current is not _NO_STATS
+
+def phase(name):
+	"""A context manager counting the time spent in it towards phase `name`."""
+	return current.phase(name)
+
+def timed(name, iterable):
+	return current.timed(name, iterable)
+
+def count(name, n = 1):
+	current.count(name, n)
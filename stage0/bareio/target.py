@@ -1,17 +1,39 @@
-import math
-import struct
+## Target parameters
+# What the stage0 tools need to know about the target's words, which every field of the builtin
+# script data is: 8 bytes, or 4 for a compact image on an ILP32 target.
+#
+# The word size is the `addr_size` of the compilation units the struct layouts are read from, and
+# `extract-structs.py` records it in the struct classes as `WORD_SIZE`, so the compiler always agrees
+# with the C it compiles for. Tools that only read C source take it as `--word-size`, which the build
+# sets from `BAREIO_WORD_SIZE`.
 
-STRUCT_HEADER = '<'
-WORD = 'q'
-WORD_SIZE = struct.calcsize(f'{WORD}')
-WORD_ALIGN = int(math.log2(WORD_SIZE))
-WORD_MIN = -2 ** (WORD_SIZE * 8 -1)
-WORD_ASM = f'.{WORD_SIZE}byte'
+from collections import namedtuple
 
-_WORD_ALIGN_BITS = 2**WORD_ALIGN - 1
+WORD_SIZES = (4, 8)
+DEFAULT_WORD_SIZE = 8
 
-def pad_size(size):
-	return ((size - 1) | _WORD_ALIGN_BITS) + 1
+class Target(namedtuple('Target', ['word_size'])):
+	@property
+	def word_align(self):
+		"""Word alignment, as a power of two (as taken by `.align`)."""
+		return self.word_size.bit_length() - 1
 
-def pad(s):
-	return s + b'\x00' * (pad_size(len(s)) - len(s))
+	@property
+	def word_min(self):
+		return -2 ** (self.word_size * 8 - 1)
+
+	@property
+	def word_max(self):
+		return 2 ** (self.word_size * 8 - 1) - 1
+
+	def pad_size(self, size):
+		return ((size - 1) | (self.word_size - 1)) + 1
+
+	def pad(self, s):
+		return s + b'\x00' * (self.pad_size(len(s)) - len(s))
+
+def for_word_size(word_size):
+	if word_size not in WORD_SIZES:
+		raise ValueError(f'unsupported word size: {word_size} (expected one of {", ".join(map(str, WORD_SIZES))})')
+
+	return Target(word_size)
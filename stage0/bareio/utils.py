@@ -1,6 +1,95 @@
+import functools
+import importlib.util
+import os
+import tempfile
+
+## Visitors
+# Handler dicts map types to handlers, and a node is handled by the first entry (in dict order) whose
+# type it is an instance of. Rather than testing every entry against every node, the matching handler
+# is looked up once per class and cached in a `Dispatcher`, which is itself cached per distinct set of
+# handlers, so handler dicts written inline still share one. Only the most recently used are kept, so
+# that handlers created afresh for every walk (such as lambdas) don't pile up in a long-lived process.
+
+class Dispatcher:
+	def __init__(self, handlers):
+		self.handlers = tuple(handlers)
+		self.classes = {}
+
+	def lookup(self, cls):
+		"""Returns the handler for instances of `cls`, or None."""
+		try:
+			return self.classes[cls]
+		except KeyError:
+			pass
+
+		handler = next((handler for type, handler in self.handlers if issubclass(cls, type)), None)
+		self.classes[cls] = handler
+
+		return handler
+
+DISPATCHER_CACHE_SIZE = 64
+
+@functools.lru_cache(maxsize = DISPATCHER_CACHE_SIZE)
+def _dispatcher(handlers):
+	return Dispatcher(handlers)
+
+def dispatcher(handlers):
+	return _dispatcher(tuple(handlers.items()))
+
+_done = object()
+
+def walk_tree(root, handlers, children, *args):
+	"""
+	Walks `root` depth first with an explicit stack, so deep trees cannot exhaust the recursion limit,
+	and returns the result of its handler. `children(node)` returns the children of a container node,
+	or None for a leaf. Leaves are handled as `handler(node, *args)`; containers after all of their
+	children, in order, as `handler(node, child_results, *args)`. Nodes without a handler give None.
+	"""
+	lookup = dispatcher(handlers).lookup
+
+	def handle(node, *extra):
+		handler = lookup(type(node))
+
+		return handler(node, *extra, *args) if handler else None
+
+	# (container, iterator over its remaining children, results of those already walked)
+	stack = []
+	node = root
+
+	while True:
+		node_children = children(node)
+
+		if node_children is not None:
+			stack.append((node, iter(node_children), []))
+		else:
+			result = handle(node)
+
+			if not stack:
+				return result
+
+			stack[-1][2].append(result)
+
+		# Move on to the next child of the innermost container, finishing off any containers that have
+		# run out.
+		while True:
+			container, remaining, results = stack[-1]
+			node = next(remaining, _done)
+
+			if node is not _done:
+				break
+
+			stack.pop()
+			result = handle(container, results)
+
+			if not stack:
+				return result
+
+			stack[-1][2].append(result)
+
 class walker:
 	def __init__(self, _handlers, **kwargs):
 		self._handlers = _handlers
+		self._dispatcher = dispatcher(_handlers)
 		self.__dict__.update(kwargs)
 
 	def walk_all(self, children, **kwargs):
@@ -8,6 +97,62 @@ class walker:
 			yield self.walk(child, **kwargs)
 	
 	def walk(self, tree, **kwargs):
-		for type, handler in self._handlers.items():
-			if isinstance(tree, type):
-				return handler(self, tree, **kwargs)
+		handler = self._dispatcher.lookup(type(tree))
+
+		if handler:
+			return handler(self, tree, **kwargs)
+
+## Generated modules
+# Generated Python (such as the struct classes from extract-structs.py) is loaded once per process
+# and kept until the file changes, so that a long-lived process only runs it again when rebuilt.
+_modules = {}
+
+def load_module(name, path):
+	"""Loads the Python source at `path` as a module called `name`, reusing it while unchanged."""
+	stat = os.stat(path)
+	key = (name, os.path.realpath(path))
+	stamp = (stat.st_mtime_ns, stat.st_size)
+
+	try:
+		cached_stamp, module = _modules[key]
+
+		if cached_stamp == stamp:
+			return module
+	except KeyError:
+		pass
+
+	spec = importlib.util.spec_from_file_location(name, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	_modules[key] = (stamp, module)
+
+	return module
+
+## Generated files
+def replace_file(path, text):
+	"""
+	Writes `text` to the file at `path`, unless it already holds exactly that, so that its modification
+	time only moves (and the build only reruns what depends on it) when it changes. Returns whether the
+	file was written. The file is replaced by renaming over it, so readers never see it partly written.
+	"""
+	data = text.encode('utf-8')
+
+	try:
+		with open(path, 'rb') as f:
+			if f.read() == data:
+				return False
+	except OSError:
+		pass
+
+	file_out = tempfile.NamedTemporaryFile(
+		dir = os.path.dirname(os.path.abspath(path)),
+		prefix = f'.{os.path.basename(path)}',
+		delete = False,
+	)
+
+	with file_out:
+		file_out.write(data)
+
+	os.replace(file_out.name, path)
+
+	return True
@@ -0,0 +1,123 @@
+## Dispatch benchmark
+# Compares the cost of builtin message dispatch with switch and dense lookup tables, by building the
+# kernel in both modes and running it under QEMU.
+#
+# Each mode is built twice: once with a script sending `--messages` messages, and once with a script
+# that only halts. The difference, divided by the message count, is the cost of one message; as both
+# modes do the same work besides lookup, the difference between modes is the cost of dispatch.
+#
+# With `--plugin` pointing at QEMU's `libinsn.so`, cost is measured in guest instructions, which is
+# exact and repeatable. Otherwise, the best wall time of `--repeat` runs is used.
+#
+# Usage: bench-dispatch.py [--messages N] [--plugin LIBINSN] [--cmake-arg ARG]... [--build-root DIR]
+#
+# Run from the source root, with whatever CMake arguments (for instance a toolchain file) your cross
+# build needs.
+
+import argparse
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ['switch', 'dense']
+
+def _build(source_root, build_dir, mode, script, cmake_args):
+	subprocess.run(
+		[
+			'cmake',
+			'-S', source_root,
+			'-B', build_dir,
+			f'-DBAREIO_DISPATCH={mode}',
+			f'-DBAREIO_BUILTIN_SCRIPTS={script}',
+		] + cmake_args,
+		check = True,
+		stdout = subprocess.DEVNULL,
+	)
+	subprocess.run(
+		['cmake', '--build', build_dir, '--target', 'kernel'],
+		check = True,
+		stdout = subprocess.DEVNULL,
+	)
+
+	return os.path.join(build_dir, 'kernel.elf')
+
+def _run(qemu, kernel, plugin, repeat):
+	command = shlex.split(qemu) + ['-kernel', kernel]
+
+	if plugin:
+		with tempfile.NamedTemporaryFile('r') as log:
+			subprocess.run(
+				command + ['-plugin', plugin, '-d', 'plugin', '-D', log.name],
+				check = True,
+				stdout = subprocess.DEVNULL,
+			)
+			result = re.search(r'insns: (\d+)', log.read())
+
+		if not result:
+			print(f'no instruction count in plugin output for {kernel}', file = sys.stderr)
+			sys.exit(1)
+
+		return int(result.group(1))
+
+	times = []
+
+	for _ in range(repeat):
+		start = time.perf_counter()
+		subprocess.run(command, check = True, stdout = subprocess.DEVNULL)
+		times.append(time.perf_counter() - start)
+
+	return min(times)
+
+arg_parser = argparse.ArgumentParser(description = 'Compare switch and dense builtin dispatch under QEMU.')
+arg_parser.add_argument('--messages', type = int, default = 10000)
+arg_parser.add_argument('--plugin', help = "path to QEMU's libinsn.so, to count instructions")
+arg_parser.add_argument('--repeat', type = int, default = 5, help = 'runs per kernel without --plugin')
+arg_parser.add_argument('--cmake-arg', action = 'append', default = [], help = 'extra argument for cmake')
+arg_parser.add_argument('--build-root', default = 'build/bench-dispatch')
+arg_parser.add_argument(
+	'--qemu',
+	default = 'qemu-system-aarch64 -M virt -cpu cortex-a57 -nographic',
+	help = 'QEMU command, without -kernel',
+)
+args = arg_parser.parse_args()
+
+source_root = os.getcwd()
+build_root = os.path.abspath(args.build_root)
+os.makedirs(build_root, exist_ok = True)
+
+workloads = {
+	'baseline': 'halt\n',
+	'messages': '"x" put\n' * args.messages + 'halt\n',
+}
+
+scripts = {}
+
+for workload, text in workloads.items():
+	scripts[workload] = os.path.join(build_root, f'{workload}.io')
+
+	with open(scripts[workload], 'w') as f:
+		f.write(text)
+
+unit = 'insns' if args.plugin else 'ns'
+per_message = {}
+
+for mode in MODES:
+	results = {}
+
+	for workload, script in scripts.items():
+		kernel = _build(source_root, os.path.join(build_root, f'{mode}-{workload}'), mode, script, args.cmake_arg)
+		results[workload] = _run(args.qemu, kernel, args.plugin, args.repeat)
+
+	cost = (results['messages'] - results['baseline']) / args.messages
+
+	if not args.plugin:
+		cost *= 1e9
+
+	per_message[mode] = cost
+	print(f'{mode:8} {cost:12.2f} {unit}/message')
+
+print(f'dense saves {per_message["switch"] - per_message["dense"]:.2f} {unit}/message')
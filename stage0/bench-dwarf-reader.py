@@ -0,0 +1,124 @@
+## DWARF reader benchmark
+# Compares collecting structs via `llvm-dwarfdump` text output against reading the objects directly,
+# checking that both give the same result.
+#
+# Usage: bench-dwarf-reader.py [--repeat N] [--generate N] [--root NAME...] [OBJECT...]
+#
+# With `--generate`, C files with N structs are compiled with `$CC` (default `cc`) and added to the
+# objects, to get a feel for larger kernels. They are split so that with `--root S<i>`, structs are
+# reached from another object than the one defining them.
+#
+# With `--root`, it also checks that collecting the structs reachable from the given roots all at once
+# gives the same result as collecting each object in parallel and merging them.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bareio import llvm_dwarfdump
+
+def _text_path(objects):
+	return llvm_dwarfdump.collect_structs(
+		subprocess.run(
+			['llvm-dwarfdump', '--debug-info'] + objects,
+			check = True,
+			stdout = subprocess.PIPE,
+			text = True,
+		).stdout
+	)
+
+def _native_path(objects):
+	return llvm_dwarfdump.collect_structs_from_objects(objects)
+
+def _compile(directory, name, lines):
+	source = os.path.join(directory, f'{name}.c')
+	output = os.path.join(directory, f'{name}.o')
+
+	with open(source, 'w') as f:
+		f.write('#include <stdint.h>\n')
+		f.writelines(line + '\n' for line in lines)
+
+	subprocess.run(
+		[os.environ.get('CC', 'cc'), '-c', '-gdwarf-4', '-g', '-o', output, source],
+		check = True,
+	)
+
+	return output
+
+def _generate_objects(directory, count):
+	# `S<i>` is only in the first object, `struct _S<i>` only in the second, and `struct _T<i>` is
+	# defined in the first but only reached through `struct _S<i>`.
+	return [
+		_compile(directory, 'generated', [
+			line
+			for i in range(count)
+			for line in (
+				f'typedef struct {{ intptr_t a; struct _S{i} *next; union {{ char *s; int64_t i; }}; char tail[]; }} S{i};',
+				f'struct _T{i} {{ intptr_t t; }} t_{i};',
+				f'S{i} *use_{i}(S{i} *s) {{ return s->next ? s : 0; }}',
+			)
+		]),
+		_compile(directory, 'generated-defs', [
+			f'struct _S{i} {{ struct _T{i} *back; }} defs_{i};'
+			for i in range(count)
+		]),
+	]
+
+def _measure(func, objects, repeat):
+	times = []
+
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = func(objects)
+		times.append(time.perf_counter() - start)
+
+	tracemalloc.start()
+	func(objects)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return result, min(times), peak
+
+arg_parser = argparse.ArgumentParser(description = 'Benchmark the DWARF struct collectors.')
+arg_parser.add_argument('objects', nargs = '*', metavar = 'OBJECT')
+arg_parser.add_argument('--repeat', type = int, default = 5)
+arg_parser.add_argument('--generate', type = int, default = 0, metavar = 'N')
+arg_parser.add_argument('--root', action = 'append', metavar = 'NAME')
+args = arg_parser.parse_args()
+
+with tempfile.TemporaryDirectory() as directory:
+	objects = list(args.objects)
+
+	if args.generate:
+		objects += _generate_objects(directory, args.generate)
+
+	if not objects:
+		arg_parser.error('no objects given')
+
+	text_result, text_time, text_peak = _measure(_text_path, objects, args.repeat)
+	native_result, native_time, native_peak = _measure(_native_path, objects, args.repeat)
+
+	if args.root:
+		serial_roots_result = llvm_dwarfdump.collect_structs_from_objects(objects, args.root)
+		parallel_roots_result = llvm_dwarfdump.collect_structs_per_object(objects, jobs = 2, roots = args.root)
+
+if text_result != native_result:
+	print('MISMATCH: collectors gave different results', file = sys.stderr)
+	sys.exit(1)
+
+if args.root:
+	if serial_roots_result != parallel_roots_result:
+		print('MISMATCH: serial and per-object collection from roots gave different results', file = sys.stderr)
+		sys.exit(1)
+
+print(f'{len(native_result)} structs from {len(objects)} objects, best of {args.repeat}')
+print(f'llvm-dwarfdump: {text_time * 1000:10.1f} ms, peak {text_peak / 1024:10.1f} KiB')
+print(f'native:         {native_time * 1000:10.1f} ms, peak {native_peak / 1024:10.1f} KiB')
+print(f'speedup:        {text_time / native_time:10.1f}x')
+
+if args.root:
+	print(f'roots:          {len(serial_roots_result):10} structs reachable from {", ".join(args.root)}')
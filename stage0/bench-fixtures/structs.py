@@ -0,0 +1,99 @@
+
+WORD_SIZE = 8
+
+def _get_label(prefix):
+	result = _get_label.next
+	_get_label.next += 1
+
+	return f'{prefix}_{result}'
+
+_get_label.next = 0
+
+def _fields(o):
+	return {slot: getattr(o, slot) for slot in o.__slots__}
+
+
+class BareioObject:
+	__slots__ = ('label', 'builtin_lookup', 'data_string', 'data_integer')
+
+	def __init__(self, *, builtin_lookup = 0, data_string = None, data_integer = None):
+		self.label = _get_label(f"BareioObject")
+		self.builtin_lookup = builtin_lookup
+		self.data_string = data_string
+		self.data_integer = data_integer
+
+	def __repr__(self):
+		return f'BareioObject({_fields(self)})'
+	
+	def compile(self, out):
+		out.words(8, (getattr(self.builtin_lookup, "label", self.builtin_lookup),), self.label)
+
+		if self.data_string is not None:
+			out.word(8, getattr(self.data_string, "label", self.data_string))
+		elif self.data_integer is not None:
+			out.word(8, self.data_integer)
+
+class BareioArguments:
+	__slots__ = ('label', 'len', 'members')
+
+	def __init__(self, *, len, members):
+		self.label = _get_label(f"BareioArguments")
+		self.len = len
+		self.members = members
+
+	def __repr__(self):
+		return f'BareioArguments({_fields(self)})'
+	
+	def compile(self, out):
+		out.words(8, (self.len, *[getattr(elem, "label", elem) for elem in self.members]), self.label)
+
+class BareioMessage:
+	__slots__ = ('label', 'name_offset', 'forced_result', 'arguments', 'resolved')
+
+	def __init__(self, *, name_offset, forced_result = 0, arguments = 0, resolved = 0):
+		self.label = _get_label(f"BareioMessage")
+		self.name_offset = name_offset
+		self.forced_result = forced_result
+		self.arguments = arguments
+		self.resolved = resolved
+
+	def __repr__(self):
+		return f'BareioMessage({_fields(self)})'
+	
+	def compile(self, out):
+		out.words(8, (self.name_offset, getattr(self.forced_result, "label", self.forced_result), getattr(self.arguments, "label", self.arguments), getattr(self.resolved, "label", self.resolved)), self.label)
+
+class BareioScript:
+	__slots__ = ('label', 'dummy', 'messages')
+
+	def __init__(self, *, dummy = 0, messages):
+		self.label = _get_label(f"BareioScript")
+		self.dummy = dummy
+		self.messages = messages
+
+	def __repr__(self):
+		return f'BareioScript({_fields(self)})'
+	
+	def compile(self, out):
+		out.words(8, (getattr(self.dummy, "label", self.dummy),), self.label)
+
+		for elem in self.messages:
+			elem.compile(out)
+
+class BareioString:
+	__slots__ = ('label', 'len', 'contents')
+
+	def __init__(self, *, len, contents):
+		self.label = _get_label(f"BareioString")
+		self.len = len
+		self.contents = contents
+
+	def __repr__(self):
+		return f'BareioString({_fields(self)})'
+	
+	def compile(self, out):
+		out.words(8, (self.len,), self.label)
+
+		out.string(self.contents)
+		out.align(3)
+
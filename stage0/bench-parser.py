@@ -0,0 +1,100 @@
+## Script parser benchmark
+# Checks that `parser.parse` agrees with the parsy grammar in `parser.script` on randomly generated
+# scripts, then times both on larger generated inputs.
+#
+# Usage: bench-parser.py [--fuzz N] [--size BYTES] [--depth N] [--seed N]
+
+import argparse
+import random
+import sys
+import time
+
+from bareio import parser
+
+# Weighted towards the characters that decide between grammar alternatives.
+_FUZZ_ALPHABET = ['a', 'put', '"', '"x y"', '0', '1', '-', '-4', '12', ' ', '\t', '\n', '(', ')', ',', '\r']
+
+def _parse_both(text):
+	results = []
+
+	for parse in (parser.script.parse, parser.parse):
+		try:
+			results.append(parse(text))
+		except parser.ParseError:
+			results.append(parser.ParseError)
+
+	return results
+
+def _fuzz(count, rng):
+	for _ in range(count):
+		text = ''.join(rng.choice(_FUZZ_ALPHABET) for _ in range(rng.randrange(0, 30)))
+		expected, actual = _parse_both(text)
+
+		if expected != actual:
+			print(f'MISMATCH on {text!r}:\n  parsy:  {expected}\n  parse:  {actual}', file = sys.stderr)
+			sys.exit(1)
+
+def _generate_flat(size, rng):
+	lines = []
+	total = 0
+
+	while total < size:
+		line = rng.choice([
+			'"some string" put',
+			f'{rng.randrange(-100000, 100000)} put',
+			'"long string" putRange(1, 4)',
+			'halt',
+		])
+		lines.append(line)
+		total += len(line) + 1
+
+	return '\n'.join(lines) + '\n'
+
+def _generate_nested(depth):
+	return 'f(' * depth + '1' + ')' * depth + '\n'
+
+def _time(parse, text):
+	start = time.perf_counter()
+
+	try:
+		parse(text)
+	except RecursionError:
+		return None
+
+	return time.perf_counter() - start
+
+def _report(label, text, include_parsy):
+	fast = _time(parser.parse, text)
+	line = f'{label:24} {len(text) / 1024:10.1f} KiB  parse: {fast * 1000:10.1f} ms'
+
+	if include_parsy:
+		slow = _time(parser.script.parse, text)
+
+		if slow is None:
+			line += '  parsy: RecursionError'
+		else:
+			line += f'  parsy: {slow * 1000:10.1f} ms ({slow / fast:.1f}x)'
+
+	print(line)
+
+arg_parser = argparse.ArgumentParser(description = 'Check and benchmark the script parsers.')
+arg_parser.add_argument('--fuzz', type = int, default = 20000, help = 'random scripts to compare')
+arg_parser.add_argument('--size', type = int, default = 4 * 1024 * 1024, help = 'size of the largest input')
+arg_parser.add_argument('--depth', type = int, default = 100000, help = 'nesting depth of the deepest input')
+arg_parser.add_argument('--seed', type = int, default = 0)
+args = arg_parser.parse_args()
+
+rng = random.Random(args.seed)
+
+_fuzz(args.fuzz, rng)
+print(f'{args.fuzz} random scripts parsed identically')
+
+# parsy is far slower, so only compare against it on the smaller inputs.
+size = 64 * 1024
+
+while size <= args.size:
+	_report('flat', _generate_flat(size, rng), size <= 256 * 1024)
+	size *= 4
+
+for depth in (100, 1000, args.depth):
+	_report(f'nested depth {depth}', _generate_nested(depth), depth <= 1000)
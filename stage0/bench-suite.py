@@ -0,0 +1,310 @@
+## Stage0 benchmark suite
+# Times the build-time tools on synthetic workloads, without needing a cross toolchain or any build
+# output: scripts and `llvm-dwarfdump` text are generated here, and compilation uses the sample
+# `bench-fixtures/structs.py` (the output of `extract-structs.py` for `src/main.c`; regenerate it when
+# the struct layouts or generator change).
+#
+# Results are written as JSON, so runs from different commits can be compared with `--compare`.
+#
+# Usage: bench-suite.py [--output FILE] [--compare OLD_FILE] [--repeat N] [--scale N] [--filter TEXT]
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from bareio import emit, interpreter, llvm_dwarfdump, parser, utils
+from bareio.llvm_dwarfdump import parser as dwarfdump_parser, store as dwarfdump_store
+
+STAGE0_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.dirname(STAGE0_DIR)
+SAMPLE_STRUCTS = os.path.join(STAGE0_DIR, 'bench-fixtures', 'structs.py')
+
+RESULTS_VERSION = 1
+
+## Fixtures
+def generate_script(messages, rng):
+	lines = []
+
+	for _ in range(messages):
+		lines.append(rng.choice([
+			f'"string {rng.randrange(100)}" put',
+			f'{rng.randrange(-100000, 100000)} put',
+			'"long string" putRange(1, 4)',
+		]))
+
+	lines.append('halt')
+
+	return '\n'.join(lines) + '\n'
+
+def generate_nested_script(depth):
+	return '"x" putRange(' * depth + '0' + ', 1)' * depth + '\nhalt\n'
+
+class _DumpWriter:
+	"""Writes the DIEs of a compile unit at `base` in the format of `llvm-dwarfdump --debug-info`."""
+
+	def __init__(self, base = 0):
+		self.dies = []
+		self.base = base
+		self.address = base + 0x0b
+
+	def die(self, indent, tag, attributes = ()):
+		address = self.address
+		self.address += 8
+
+		lines = [f'0x{address:08x}: ' + '  ' * indent + tag]
+		lines += [' ' * (14 + 2 * indent) + f'{name}\t({value})' for name, value in attributes]
+		self.dies.append('\n'.join(lines))
+
+		return address
+
+	def null(self, indent):
+		self.die(indent, 'NULL')
+
+	def text(self):
+		length = self.address - self.base - 4
+
+		return (
+			f'0x{self.base:08x}: Compile Unit: length = 0x{length:08x}, format = DWARF32, version = 0x0004, '
+			f'abbr_offset = 0x0000, addr_size = 0x08 (next unit at 0x{self.address:08x})\n\n' +
+			'\n\n'.join(self.dies) + '\n'
+		)
+
+def generate_dwarfdump(struct_count, units = 1):
+	"""
+	Generates `units` compile units, each with the same `struct_count` typedef'd structs of a dozen DIEs
+	each, as if they all included one header.
+	"""
+	texts = []
+	base = 0
+
+	for _ in range(units):
+		w = _generate_dwarfdump_unit(struct_count, base)
+		texts.append(w.text())
+		base = w.address
+
+	return (
+		'synthetic.o:\tfile format elf64-littleaarch64\n\n'
+		'.debug_info contents:\n' +
+		'\n'.join(texts)
+	)
+
+def _generate_dwarfdump_unit(struct_count, base):
+	w = _DumpWriter(base)
+
+	def ref(address, name):
+		return f'0x{address:08x} "{name}"'
+
+	w.die(0, 'DW_TAG_compile_unit', [('DW_AT_name', '"synthetic.c"'), ('DW_AT_language', 'DW_LANG_C99')])
+	long_type = w.die(1, 'DW_TAG_base_type', [('DW_AT_byte_size', '0x08'), ('DW_AT_name', '"long int"')])
+	char_type = w.die(1, 'DW_TAG_base_type', [('DW_AT_byte_size', '0x01'), ('DW_AT_name', '"char"')])
+	void_pointer = w.die(1, 'DW_TAG_pointer_type', [('DW_AT_byte_size', '0x08')])
+
+	for i in range(struct_count):
+		# Addresses of the DIEs after this struct's, which its members refer to.
+		struct_address = w.address
+		union_address = struct_address + 8 * 6
+		array_address = union_address + 8 * 4
+		w.die(1, 'DW_TAG_structure_type', [('DW_AT_byte_size', '0x18'), ('DW_AT_decl_line', str(i))])
+		w.die(2, 'DW_TAG_member', [('DW_AT_name', '"len"'), ('DW_AT_type', ref(long_type, 'long int')), ('DW_AT_data_member_location', '0x00')])
+		w.die(2, 'DW_TAG_member', [('DW_AT_name', '"next"'), ('DW_AT_type', ref(void_pointer, 'void *')), ('DW_AT_data_member_location', '0x08')])
+		w.die(2, 'DW_TAG_member', [('DW_AT_type', ref(union_address, 'union')), ('DW_AT_data_member_location', '0x10')])
+		w.die(2, 'DW_TAG_member', [('DW_AT_name', '"contents"'), ('DW_AT_type', ref(array_address, 'char[]')), ('DW_AT_data_member_location', '0x18')])
+		w.null(2)
+		w.die(1, 'DW_TAG_union_type', [('DW_AT_byte_size', '0x08')])
+		w.die(2, 'DW_TAG_member', [('DW_AT_name', '"data_pointer"'), ('DW_AT_type', ref(void_pointer, 'void *'))])
+		w.die(2, 'DW_TAG_member', [('DW_AT_name', '"data_integer"'), ('DW_AT_type', ref(long_type, 'long int'))])
+		w.null(2)
+		w.die(1, 'DW_TAG_array_type', [('DW_AT_type', ref(char_type, 'char'))])
+		w.die(2, 'DW_TAG_subrange_type', [('DW_AT_type', ref(long_type, 'long int'))])
+		w.null(2)
+		w.die(1, 'DW_TAG_typedef', [('DW_AT_name', f'"Struct{i}"'), ('DW_AT_type', ref(struct_address, f'Struct{i}'))])
+
+	w.null(1)
+
+	return w
+
+## Running
+def measure(func, repeat):
+	times = []
+
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+
+	return min(times)
+
+def run_compiler(script):
+	subprocess.run(
+		[sys.executable, os.path.join(STAGE0_DIR, 'compiler.py'), '--structs', SAMPLE_STRUCTS],
+		input = script,
+		text = True,
+		check = True,
+		stdout = subprocess.DEVNULL,
+		cwd = SOURCE_DIR,
+	)
+
+def benchmarks(scale, rng):
+	"""Yields `(name, size, func)` for each benchmark."""
+	for messages in (250 * scale, 1000 * scale):
+		script = generate_script(messages, rng)
+		yield f'parser.script/flat/{messages}', len(script), lambda script = script: parser.script.parse(script)
+		yield f'parser.parse/flat/{messages}', len(script), lambda script = script: parser.parse(script)
+
+	# parsy recurses dozens of frames per nesting level and overflows the stack before depth 20, so it
+	# only gets the shallow scripts.
+	for depth in (5, 15, 200):
+		script = generate_nested_script(depth)
+
+		if depth < 20:
+			yield f'parser.script/nested/{depth}', len(script), lambda script = script: parser.script.parse(script)
+
+		yield f'parser.parse/nested/{depth}', len(script), lambda script = script: parser.parse(script)
+
+	# Walks with as many handlers as the compiler, with the catch-all last.
+	walk_handlers = {
+		parser.NamedMessage: lambda node, results: len(results),
+		parser.String: lambda node: 0,
+		parser.Integer: lambda node: 0,
+		parser.ResetContext: lambda node: 0,
+		parser.Script: lambda node, results: len(results),
+		object: lambda node, *args: None,
+	}
+
+	for name, script in (
+		(f'flat/{1000 * scale}', generate_script(1000 * scale, rng)),
+		('nested/2000', generate_nested_script(2000)),
+	):
+		tree = parser.parse(script)
+		yield f'ASTNode.walk/{name}', len(script), lambda tree = tree: tree.walk(walk_handlers)
+
+	script = generate_script(1000 * scale, rng)
+	script_messages = interpreter.from_ast(parser.parse(script))
+	yield (
+		f'Interpreter.run/{1000 * scale}',
+		len(script),
+		lambda: interpreter.Interpreter(io.BytesIO()).run(script_messages),
+	)
+
+	structs = utils.load_module('structs', SAMPLE_STRUCTS)
+	objects = []
+
+	for i in range(1000 * scale):
+		string = structs.BareioString(len = 8, contents = f'string {i}')
+		arguments = structs.BareioArguments(len = 2, members = [string, emit.Offset(string.label, 2)])
+		objects += [string, arguments, structs.BareioMessage(name_offset = i, forced_result = string, arguments = arguments)]
+
+	for name, make_emitter in (('asm', lambda: emit.AsmEmitter(io.StringIO())), ('elf', lambda: emit.ElfEmitter(io.BytesIO()))):
+		def compile_objects(make_emitter = make_emitter):
+			out = make_emitter()
+			out.section('.data')
+
+			for o in objects:
+				o.compile(out)
+
+			out.close()
+
+		yield f'struct.compile/{name}/{len(objects)}', len(objects), compile_objects
+
+	for struct_count in (100 * scale, 400 * scale):
+		text = generate_dwarfdump(struct_count)
+		die_count = text.count('\n0x')
+		yield (
+			f'dwarfdump+combine_dies/{die_count}',
+			len(text),
+			lambda text = text: [list(dwarfdump_parser.combine_dies(file)) for file in dwarfdump_parser.dwarfdump.parse(text)],
+		)
+
+		files = dwarfdump_parser.dwarfdump.parse(text)
+		yield f'store.combine_dies/{die_count}', len(text), lambda files = files: [list(dwarfdump_store.combine_dies(file)) for file in files]
+
+		for prefix, combine in (('', dwarfdump_parser.combine_dies), ('store/', dwarfdump_store.combine_dies)):
+			units = [unit for file in files for unit in combine(file)]
+			yield f'collect_structs/{prefix}{die_count}', len(text), lambda units = units: llvm_dwarfdump.collect_structs_from_units(units)
+
+		# As with --root, for a struct reaching none of the others.
+		yield (
+			f'collect_structs/store/roots/{die_count}',
+			len(text),
+			lambda units = units: llvm_dwarfdump.collect_structs_from_units(units, ['Struct0']),
+		)
+
+	# Many units repeating the same header types.
+	text = generate_dwarfdump(50 * scale, units = 20)
+	die_count = text.count('\n0x')
+	units = [unit for file in dwarfdump_parser.dwarfdump.parse(text) for unit in dwarfdump_store.combine_dies(file)]
+	yield f'collect_structs/store/units/{die_count}', len(text), lambda units = units: llvm_dwarfdump.collect_structs_from_units(units)
+
+	for messages in (1000 * scale, 4000 * scale):
+		script = generate_script(messages, rng)
+		yield f'compiler.py/{messages}', len(script), lambda script = script: run_compiler(script)
+
+def compare(results, old_results):
+	for name, result in results.items():
+		old = old_results.get(name)
+
+		if old is None:
+			continue
+
+		ratio = result['seconds'] / old['seconds']
+		flag = '  REGRESSION' if ratio > 1.1 else ''
+		print(f'{name:40} {old["seconds"] * 1000:10.2f} -> {result["seconds"] * 1000:10.2f} ms ({ratio:.2f}x){flag}', file = sys.stderr)
+
+def git_revision():
+	try:
+		return subprocess.run(
+			['git', 'rev-parse', 'HEAD'],
+			cwd = SOURCE_DIR,
+			check = True,
+			stdout = subprocess.PIPE,
+			stderr = subprocess.DEVNULL,
+			text = True,
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+arg_parser = argparse.ArgumentParser(description = 'Benchmark the stage0 tools on synthetic workloads.')
+arg_parser.add_argument('--output', help = 'write results to this file instead of stdout')
+arg_parser.add_argument('--compare', metavar = 'OLD_FILE', help = 'compare against earlier results')
+arg_parser.add_argument('--repeat', type = int, default = 3)
+arg_parser.add_argument('--scale', type = int, default = 1, help = 'multiply workload sizes by this')
+arg_parser.add_argument('--filter', default = '', help = 'only run benchmarks whose name contains this')
+arg_parser.add_argument('--seed', type = int, default = 0)
+args = arg_parser.parse_args()
+
+results = {}
+
+for name, size, func in benchmarks(args.scale, random.Random(args.seed)):
+	if args.filter not in name:
+		continue
+
+	seconds = measure(func, args.repeat)
+	results[name] = {'seconds': seconds, 'input_bytes': size}
+	print(f'{name:40} {seconds * 1000:10.2f} ms', file = sys.stderr)
+
+report = {
+	'version': RESULTS_VERSION,
+	'revision': git_revision(),
+	'python': platform.python_version(),
+	'repeat': args.repeat,
+	'scale': args.scale,
+	'results': results,
+}
+
+if args.compare:
+	with open(args.compare) as f:
+		compare(results, json.load(f)['results'])
+
+if args.output:
+	with open(args.output, 'w') as f:
+		json.dump(report, f, indent = '\t')
+		f.write('\n')
+else:
+	json.dump(report, sys.stdout, indent = '\t')
+	print()
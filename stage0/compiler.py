@@ -1,88 +1,650 @@
-from collections import deque
+import argparse
+from bisect import bisect_right
+from collections import namedtuple
 from dataclasses import dataclass, field
+import hashlib
+import inspect
 import sys
 from typing import Optional, Union
 
-from bareio import parser, target
-
-import importlib.util
-spec = importlib.util.spec_from_file_location('bareio.structs', 'build/structs.py')
-structs = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(structs)
+from bareio import builtins, emit, parser, profile, stats, target, utils
+from bareio.cache import PickleCache, file_digest
 
 if sys.version_info[0] < 3:
 	print('Python 3.0+ required', file=sys.stderr)
 	sys.exit(1)
 
-BUILTIN_MESSAGE_BASE = target.WORD_MIN
 MESSAGES_RESET_CONTEXT = -2
 MESSAGES_END = -1
+# Tag on object references that hold an integer (shifted left by one) instead of pointing at an object.
+INTEGER_TAG = 1
+# Tag on `BareioArguments` members that point straight at a literal's object, rather than at a script.
+# Immediate integers are stored as they are, since `INTEGER_TAG` tells them apart.
+ARGUMENT_LITERAL = 2
+
+arg_parser = argparse.ArgumentParser(description = 'Compile builtin .io scripts.')
+arg_parser.add_argument(
+	'sources',
+	nargs = '*',
+	metavar = 'SOURCE',
+	help = 'scripts to compile separately and link, in order (default: a single script on stdin)',
+)
+arg_parser.add_argument(
+	'--format',
+	choices = ['asm', 'elf'],
+	default = 'asm',
+	help = 'write assembler source, or an AArch64 ELF relocatable object',
+)
+arg_parser.add_argument(
+	'--word-size',
+	type = int,
+	choices = target.WORD_SIZES,
+	help = 'fail unless STRUCTS were generated for words of this many bytes (the word size is '
+		'otherwise taken from STRUCTS)',
+)
+arg_parser.add_argument(
+	'--no-pool',
+	action = 'store_true',
+	help = 'emit a separate object for every literal, instead of sharing identical ones',
+)
+arg_parser.add_argument(
+	'--pool-stats',
+	action = 'store_true',
+	help = 'report how much data sharing literals saved on stderr',
+)
+arg_parser.add_argument(
+	'--section-stats',
+	action = 'store_true',
+	help = 'report the size of each output section on stderr',
+)
+arg_parser.add_argument(
+	'--builtin-contexts',
+	metavar = 'FILE',
+	help = 'builtin messages of each context, from extract-builtin-message-tables.py; '
+		'sends to receivers of known type are then resolved at build time',
+)
+arg_parser.add_argument(
+	'--reachable-out',
+	metavar = 'FILE',
+	help = 'write the builtin messages each context must still look up (those sent without being '
+		'resolved), in the format of --builtin-contexts, for extract-builtin-message-tables.py --reachable',
+)
+arg_parser.add_argument(
+	'--profile',
+	metavar = 'MAP',
+	help = 'give every message a run counter, and write where each counted message is in the sources '
+		'to MAP, for profile-report.py (needs structs from C built with BAREIO_PROFILE)',
+)
+arg_parser.add_argument(
+	'--cache-dir',
+	help = 'reuse the compiled fragments of unchanged SOURCEs, cached in this directory',
+)
+arg_parser.add_argument(
+	'--cache-stats',
+	action = 'store_true',
+	help = 'report fragment cache hits and misses on stderr',
+)
+arg_parser.add_argument(
+	'--structs',
+	default = 'build/structs.py',
+	help = 'struct classes generated by extract-structs.py',
+)
+arg_parser.add_argument(
+	'--lock-file',
+	default = 'src/method-names.lock',
+	help = 'message name lock file, fixing builtin message offsets',
+)
+stats.add_option(arg_parser)
+args = arg_parser.parse_args()
+
+if args.reachable_out and not args.builtin_contexts:
+	arg_parser.error('--reachable-out requires --builtin-contexts')
+
+stats.start('compiler.py', args.stats)
+
+with stats.phase('load_structs'):
+	structs = utils.load_module('bareio.structs', args.structs)
+
+structs._get_label.next = 0
+
+### Target
+# The struct classes record the word size of the C they were generated from.
+word_target = target.for_word_size(structs.WORD_SIZE)
+
+if args.word_size is not None and args.word_size != word_target.word_size:
+	arg_parser.error(f'{args.structs} is for {word_target.word_size}-byte words, not {args.word_size}')
+
+BUILTIN_MESSAGE_BASE = word_target.word_min
+IMMEDIATE_MIN = word_target.word_min >> 1
+IMMEDIATE_MAX = -IMMEDIATE_MIN - 1
+
+if args.profile and 'count' not in inspect.signature(structs.BareioMessage).parameters:
+	arg_parser.error('--profile needs BareioMessage to have a count field (build with BAREIO_PROFILE)')
 
 method_offsets = {
 	method_name.strip(): BUILTIN_MESSAGE_BASE + i
 	for i, method_name
-	in enumerate(open('src/method-names.lock'))
+	in enumerate(open(args.lock_file))
 }
 
-pending = deque()
+out = emit.ElfEmitter(word_size = word_target.word_size) if args.format == 'elf' else emit.AsmEmitter()
+
+if args.section_stats:
+	section_sizes = emit.SizeEmitter()
+	out = emit.TeeEmitter(out, section_sizes)
+
+pending = []
+
+### Constant pool
+# Literal objects are immutable, so every occurrence of the same literal can point at one object.
+class ConstantPool:
+	def __init__(self, enabled = True):
+		self.enabled = enabled
+		self.objects = {}
+		self.reused = 0
+		self.saved_bytes = 0
+
+	def intern(self, key, make):
+		"""
+		Returns the object for the literal `key`, calling `make` to create it (and returning the list of
+		data it added to `pending`) the first time.
+		"""
+		if self.enabled and key in self.objects:
+			o, size = self.objects[key]
+			self.reused += 1
+			self.saved_bytes += size
+
+			return o
+
+		o, data = make()
+
+		size_out = emit.SizeEmitter()
+
+		for d in data:
+			d.compile(size_out)
+
+		self.objects[key] = (o, size_out.size)
+
+		return o
+
+	def stats(self):
+		return f'constant pool: {len(self.objects)} literals, {self.reused} reused, {self.saved_bytes} bytes saved'
+
+pool = ConstantPool(enabled = not args.no_pool)
+
+### Send resolution
+# Where the receiver of a builtin message is known at build time (straight after a literal, or after
+# a context reset in the top-level script, whose context is the globals), the message's function is
+# looked up now and stored in `resolved`, so the interpreter can skip `builtin_lookup`.
+builtin_contexts = {}
+
+if args.builtin_contexts:
+	with open(args.builtin_contexts, encoding = 'utf-8') as f:
+		builtin_contexts = builtins.read_contexts(f)
+
+message_names = {offset: name for name, offset in method_offsets.items()}
+
+def literal_context(o):
+	"""Returns the context of the literal `o`, an object or an immediate integer."""
+	if isinstance(o, int):
+		return 'integer'
+
+	return builtins.lookup_context(o.builtin_lookup)
+
+def resolve_sends(messages, context = None, receiver = None):
+	"""
+	Resolves what sends in `messages` it can. `context` is the context the script runs in, if known,
+	and `receiver` the context of the receiver of the first message.
+	"""
+	for message in messages:
+		if message.name_offset == MESSAGES_RESET_CONTEXT:
+			receiver = context
+			continue
+
+		if message.forced_result:
+			receiver = literal_context(message.forced_result)
+
+		if message.name_offset < 0:
+			name = message_names.get(message.name_offset)
+
+			if receiver is not None and name in builtin_contexts.get(receiver, ()):
+				message.resolved = builtins.func_name(receiver, name)
+
+			# Builtins may return anything.
+			receiver = None
+
+### Reachable builtins
+# Every builtin message send is recorded, so that once sends have been resolved, the messages that
+# still go through `builtin_lookup` are known. Only those need entries in the lookup tables; resolved
+# sends reference their functions directly.
+sends = []
+
+def dispatched_messages(sends):
+	return frozenset(
+		message_names[message.name_offset]
+		for message in sends
+		if not message.resolved
+	)
+
+def write_reachable(f, dispatched):
+	builtins.write_contexts(f, {
+		context: messages & dispatched
+		for context, messages in builtin_contexts.items()
+	})
+
+### Profiling
+# With `--profile`, every message from the source gets a `count` word, which the interpreter
+# increments each time it runs the message. `_bareio_profile_messages` lists the counted messages, in
+# the order of the profile map. See `bareio.profile`.
+PROFILE_TABLE = '_bareio_profile_messages'
+
+# Label of each counted message -> (offset in the source, description)
+profiled = {}
+
+def new_message(node = None, description = None, **fields):
+	"""Makes a `BareioMessage`, counted when profiling if it comes from the source `node`."""
+	if args.profile:
+		fields['count'] = 0
+
+	message = structs.BareioMessage(**fields)
+
+	if args.profile and node is not None:
+		profiled[message.label] = (getattr(node, 'position', None), description)
+
+	return message
+
+def take_profiled(text):
+	"""Returns `(label, line, column, description)` for each message counted in `text`, and forgets them."""
+	line_starts = [0] + [i + 1 for i, c in enumerate(text) if c == '\n']
+	result = []
+
+	for label, (position, description) in profiled.items():
+		if position is None:
+			line = column = None
+		else:
+			line = bisect_right(line_starts, position)
+			column = position - line_starts[line - 1] + 1
+
+		result.append((label, line, column, description))
+
+	profiled.clear()
+
+	return result
+
+def compile_profile_table(out, labels):
+	out.global_symbol(PROFILE_TABLE)
+	out.words(word_target.word_size, [*labels, 0], PROFILE_TABLE)
+
+### Layout
+# Data is created in the order the parser finishes with it, which scatters a message's literals and
+# arguments across the output. Instead, it is laid out depth first from the script that refers to
+# it, so each script's messages are followed by their literal objects, then their arguments and
+# argument scripts, and the interpreter touches fewer cache lines running them. Strings are never
+# written to, so they go in `.rodata`, apart from the mutable data.
+def _references(o, labelled):
+	for name in o.__slots__:
+		value = getattr(o, name)
+
+		for item in value if isinstance(value, list) else [value]:
+			if isinstance(item, emit.Offset):
+				item = labelled.get(item.target)
+
+			if hasattr(item, 'compile'):
+				yield item
 
-print('.section .data')
-print('.global _builtin_script')
-print('_builtin_script:')
+def lay_out(root, objects):
+	"""
+	Orders `objects` (the data referred to from the script `root`, excluding the script itself) depth
+	first from `root`, and returns them split into `(data, rodata)`.
+	"""
+	remaining = {id(o): o for o in objects}
+	labelled = {o.label: o for o in objects}
+	data = []
+	rodata = []
+
+	seen = set()
+	stack = [root]
+
+	while stack:
+		o = stack.pop()
+
+		if id(o) in seen:
+			continue
+
+		seen.add(id(o))
+
+		if remaining.pop(id(o), None) is not None:
+			(rodata if isinstance(o, structs.BareioString) else data).append(o)
+
+		stack.extend(reversed(list(_references(o, labelled))))
+
+	# Anything unreachable from `root` still goes out, in the order it was created.
+	for o in remaining.values():
+		(rodata if isinstance(o, structs.BareioString) else data).append(o)
+
+	return data, rodata
+
+# `.rodata` is collected here, and emitted after everything in `.data`.
+rodata_out = emit.RecordingEmitter()
+
+out.section('.data')
+out.global_symbol('_builtin_script')
+out.label('_builtin_script')
+
+def _literal_argument(script):
+	"""Returns the object of the literal that `script` consists of, or None."""
+	if len(script.messages) != 2:
+		return None
+
+	message = script.messages[0]
+
+	return message.forced_result if message.name_offset == 0 else None
 
 def handle_named_message(message, argument_scripts):
 	arguments = 0
 
 	if argument_scripts:
+		members = []
+
+		# An argument that is just a literal is its object, so it is referenced directly, and the
+		# interpreter doesn't need to run a script for it.
 		for a in argument_scripts:
-			pending.append(a)
+			o = _literal_argument(a)
+
+			if o:
+				members.append(o if isinstance(o, int) else emit.Offset(o.label, ARGUMENT_LITERAL))
+				# Its script, and so its message, is never emitted.
+				profiled.pop(a.messages[0].label, None)
+			else:
+				pending.append(a)
+				members.append(a)
 
 		arguments = structs.BareioArguments(
 			len = len(argument_scripts),
-			members = argument_scripts,
+			members = members,
 		)
 		pending.append(arguments)
 	
-	return structs.BareioMessage(
+	result = new_message(
+		message,
+		message.name,
 		name_offset = method_offsets[message.name],
 		arguments = arguments,
 	)
+	sends.append(result)
+
+	return result
 
 def handle_string(string):
-	s = structs.BareioString(len = len(string.contents), contents = string.contents)
-	pending.append(s)
-	o = structs.BareioObject(
-		data_string = s,
-		builtin_lookup = '_bareio_builtin_string_lookup',
-	)
-	pending.append(o)
+	def _make():
+		s = structs.BareioString(len = len(string.contents), contents = string.contents)
+		pending.append(s)
+		o = structs.BareioObject(
+			data_string = s,
+			builtin_lookup = builtins.lookup_name('string'),
+		)
+		pending.append(o)
+
+		return o, [s, o]
+
+	o = pool.intern(('string', string.contents), _make)
 
-	return structs.BareioMessage(name_offset = 0, forced_result = o)
+	return new_message(string, f'"{string.contents}"', name_offset = 0, forced_result = o)
 
 def handle_integer(integer):
-	o = structs.BareioObject(
-		data_integer = integer.value,
-		builtin_lookup = '_bareio_builtin_integer_lookup',
-	)
-	pending.append(o)
+	if not word_target.word_min <= integer.value <= word_target.word_max:
+		print(f'integer literal out of range for {word_target.word_size}-byte words: {integer.value}', file = sys.stderr)
+		sys.exit(1)
+
+	# Integers that fit are immediate: the reference is the integer, so no object is emitted for it.
+	if IMMEDIATE_MIN <= integer.value <= IMMEDIATE_MAX:
+		return new_message(
+			integer,
+			str(integer.value),
+			name_offset = 0,
+			forced_result = (integer.value << 1) | INTEGER_TAG,
+		)
+
+	def _make():
+		o = structs.BareioObject(
+			data_integer = integer.value,
+			builtin_lookup = builtins.lookup_name('integer'),
+		)
+		pending.append(o)
+
+		return o, [o]
 
-	return structs.BareioMessage(name_offset = 0, forced_result = o)
+	o = pool.intern(('integer', integer.value), _make)
 
-def handle_reset_context(_):
-	return structs.BareioMessage(name_offset = MESSAGES_RESET_CONTEXT)
+	return new_message(integer, str(integer.value), name_offset = 0, forced_result = o)
+
+def handle_reset_context(reset_context):
+	return new_message(reset_context, '(newline)', name_offset = MESSAGES_RESET_CONTEXT)
 
 def handle_script(_, messages):
+	# Argument scripts run in the context of whichever builtin runs them, so only sends to literals
+	# can be resolved here.
+	resolve_sends(messages)
+
 	return structs.BareioScript(
-		messages = messages + [structs.BareioMessage(name_offset = MESSAGES_END)],
+		messages = messages + [new_message(name_offset = MESSAGES_END)],
 	)
 
-parser.script.parse(sys.stdin.read()).walk({
+handlers = {
 	parser.NamedMessage: handle_named_message,
 	parser.String: handle_string,
 	parser.Integer: handle_integer,
 	parser.ResetContext: handle_reset_context,
 	parser.Script: handle_script,
-}).compile()
+}
+
+_count_nodes = {object: lambda node, results = (): 1 + sum(results)}
+
+def parse(text):
+	with stats.phase('parse'):
+		tree = parser.parse(text)
+
+	if stats.enabled():
+		stats.count('ast_nodes', tree.walk(_count_nodes))
+
+	return tree
+
+### Fragments
+# With several sources, each is compiled on its own into a fragment: the recorded emitter calls for
+# its top-level messages, and for everything they reference. Fragments only depend on their source
+# (plus the struct layouts and message offsets), so they can be cached, and are then linked into
+# `_builtin_script` with their labels renamed apart.
+#
+# Sources are linked as if concatenated, so each should end with a newline to reset the context, as
+# when they were `cat`ed together.
+#
+# Fragments also carry the names of the builtin messages they send without resolving them, and, when
+# profiling, `(label, line, column, description)` for each counted message.
+Fragment = namedtuple('Fragment', ['messages', 'data', 'rodata', 'dispatched', 'profiled'])
+
+# Bump whenever the output for the same source could change.
+FRAGMENT_VERSION = 6
+
+class FragmentCache(PickleCache):
+	name = 'fragment cache'
+
+	def __init__(self, directory, *cache_args, **cache_kwargs):
+		super().__init__(directory, *cache_args, **cache_kwargs)
+
+		# Everything besides the source that a fragment depends on.
+		digest = hashlib.sha256(f'{FRAGMENT_VERSION}:{args_key()}:'.encode('utf-8'))
+
+		for path in (__file__, args.structs, args.lock_file, args.builtin_contexts):
+			if path:
+				file_digest(path, digest)
+
+		self._base_digest = digest
+
+	def key(self, path):
+		return file_digest(path, self._base_digest.copy()).hexdigest()
+
+def args_key():
+	return f'no_pool={args.no_pool},profile={bool(args.profile)}'
+
+def compile_fragment(text):
+	# Fragments are compiled independently, so they share neither labels nor literal objects.
+	structs._get_label.next = 0
+	pool.objects = {}
+	sends.clear()
+
+	tree = parse(text)
+
+	with stats.phase('walk'):
+		script = tree.walk(handlers)
+		# The receiver at the start of a fragment depends on how the previous one ended.
+		resolve_sends(script.messages, context = 'globals')
+
+	with stats.phase('layout'):
+		data_objects, rodata_objects = lay_out(script, pending)
+		pending.clear()
+
+	messages = emit.RecordingEmitter()
+	data = emit.RecordingEmitter()
+	rodata = emit.RecordingEmitter()
+
+	with stats.phase('emit'):
+		for message in script.messages[:-1]:
+			message.compile(messages)
+
+		for o in data_objects:
+			o.compile(data)
+
+		for o in rodata_objects:
+			o.compile(rodata)
+
+	return Fragment(
+		messages.calls,
+		data.calls,
+		rodata.calls,
+		dispatched_messages(sends),
+		take_profiled(text),
+	)
+
+class _LinkedFragment:
+	"""Stands in for a fragment's messages in the linked `_builtin_script`."""
+
+	def __init__(self, fragment, index):
+		self.fragment = fragment
+
+		defined = emit.RecordingEmitter()
+		defined.calls = fragment.messages + fragment.data + fragment.rodata
+		self.rename = {label: f'_fragment{index}_{label}' for label in defined.defined_labels()}
+
+	def compile(self, out):
+		emit.replay(self.fragment.messages, out, self.rename)
+
+	def compile_data(self, out):
+		emit.replay(self.fragment.data, out, self.rename)
+
+	def compile_rodata(self, out):
+		emit.replay(self.fragment.rodata, out, self.rename)
+
+if args.sources:
+	cache = FragmentCache(args.cache_dir) if args.cache_dir else None
+	fragments = []
+
+	for path in args.sources:
+		key = fragment = None
+
+		if cache:
+			with stats.phase('cache'):
+				key = cache.key(path)
+				fragment = cache.get(key)
+
+		if fragment is None:
+			with open(path, encoding = 'utf-8') as f:
+				fragment = compile_fragment(f.read())
+
+			if cache:
+				with stats.phase('cache'):
+					cache.put(key, fragment)
+
+		fragments.append(fragment)
+
+	if cache:
+		with stats.phase('cache'):
+			cache.evict()
+
+	with stats.phase('emit'):
+		linked = [_LinkedFragment(fragment, i) for i, fragment in enumerate(fragments)]
+
+		structs._get_label.next = 0
+		structs.BareioScript(
+			messages = linked + [new_message(name_offset = MESSAGES_END)],
+		).compile(out)
+
+		for fragment in linked:
+			fragment.compile_data(out)
+			fragment.compile_rodata(rodata_out)
+
+	# The script and its end message, and the objects defined in each fragment.
+	stats.count('objects', 2 + sum(len(fragment.rename) for fragment in linked))
+
+	profile_messages = [
+		(fragment.rename[label], path, line, column, description)
+		for path, fragment in zip(args.sources, linked)
+		for label, line, column, description in fragment.fragment.profiled
+	]
+
+	dispatched = frozenset().union(*(fragment.dispatched for fragment in fragments))
+
+	if cache and args.cache_stats:
+		print(cache.stats(), file = sys.stderr)
+else:
+	text = sys.stdin.read()
+	tree = parse(text)
+
+	with stats.phase('walk'):
+		script = tree.walk(handlers)
+		resolve_sends(script.messages, context = 'globals', receiver = 'globals')
+
+	with stats.phase('layout'):
+		data, rodata = lay_out(script, pending)
+		pending.clear()
+
+	with stats.phase('emit'):
+		script.compile(out)
+
+		for o in data:
+			o.compile(out)
+
+		for o in rodata:
+			o.compile(rodata_out)
+
+	stats.count('objects', 1 + len(script.messages) + len(data) + len(rodata))
+
+	dispatched = dispatched_messages(sends)
+	profile_messages = [
+		(label, '<stdin>', line, column, description)
+		for label, line, column, description in take_profiled(text)
+	]
+
+with stats.phase('emit'):
+	if args.profile:
+		compile_profile_table(out, [label for label, *_ in profile_messages])
+
+	out.section('.rodata')
+	emit.replay(rodata_out.calls, out)
+	out.close()
+
+if args.profile:
+	with open(args.profile, 'w', encoding = 'utf-8') as f:
+		profile.write_map(f, [location for _, *location in profile_messages])
+
+if args.reachable_out:
+	with open(args.reachable_out, 'w', encoding = 'utf-8') as f:
+		write_reachable(f, dispatched)
+
+if args.pool_stats:
+	print(pool.stats(), file = sys.stderr)
+
+if args.section_stats:
+	for name, size in section_sizes.sections.items():
+		print(f'{name}: {size} bytes', file = sys.stderr)
 
-while pending:
-	pending.popleft().compile()
+stats.finish()
@@ -1,14 +1,14 @@
+import argparse
 from collections import OrderedDict
 import os
 import re
 import sys
 import tempfile
 
-from bareio import target
+from bareio import builtins, stats, target
 
 ## Patterns
 message_decl_pattern = re.compile(r'^BAREIO_MESSAGE\(([^,]+), ([^)]+)\)')
-func_disallowed_chars_pattern = re.compile(r'^[^A-Za-z_]|[^A-Za-z0-9_]')
 
 ## Setup
 # Check Python version and arguments.
@@ -16,11 +16,43 @@ if sys.version_info[0] < 3:
 	print('Python 3.0+ required', file=sys.stderr)
 	sys.exit(1)
 
-if len(sys.argv) != 2:
-	print(f'Usage {sys.argv[0]} LOCK_FILE', file=sys.stderr)
-	sys.exit(1)
+arg_parser = argparse.ArgumentParser(description = 'Generate builtin message lookup functions from C read on stdin.')
+arg_parser.add_argument('lock_file', metavar = 'LOCK_FILE')
+arg_parser.add_argument(
+	'--dense',
+	action = 'store_true',
+	help = 'look messages up in arrays indexed by offset, rather than with a switch',
+)
+arg_parser.add_argument(
+	'--contexts-out',
+	metavar = 'FILE',
+	help = 'also write the builtin messages of each context to FILE, for the compiler',
+)
+arg_parser.add_argument(
+	'--word-size',
+	type = int,
+	choices = target.WORD_SIZES,
+	default = target.DEFAULT_WORD_SIZE,
+	help = 'size in bytes of the target\'s words (ptrdiff_t), which message offsets are counted in',
+)
+arg_parser.add_argument(
+	'--reachable',
+	metavar = 'FILE',
+	help = 'only emit lookup entries for the messages each context has in FILE (from compiler.py '
+		'--reachable-out); offsets still follow the lock file',
+)
+stats.add_option(arg_parser)
+args = arg_parser.parse_args()
 
-lock_file_name = sys.argv[1]
+stats.start('extract-builtin-message-tables.py', args.stats)
+
+lock_file_name = args.lock_file
+
+reachable = None
+
+if args.reachable:
+	with open(args.reachable, encoding = 'utf-8') as f:
+		reachable = builtins.read_contexts(f)
 
 ### Read lock file
 # The lock file fixes both the known methods and their order, so that as message names are added and
@@ -37,15 +69,19 @@ except OSError:
 
 ## C parsing
 
-for line in sys.stdin:
-	result = message_decl_pattern.match(line)
+with stats.phase('parse'):
+	for line in sys.stdin:
+		result = message_decl_pattern.match(line)
 
-	if not result: continue
+		if not result: continue
 
-	context, message_name = result.groups()
+		context, message_name = result.groups()
 	
-	contexts.add(context)
-	message_contexts.setdefault(message_name, set()).add(context)
+		contexts.add(context)
+		message_contexts.setdefault(message_name, set()).add(context)
+
+stats.count('messages', len(message_contexts))
+stats.count('contexts', len(contexts))
 
 ## Output
 # We write to the lock file by outputting to a tempfile, then renaming over.
@@ -60,46 +96,106 @@ lock_file_out = tempfile.NamedTemporaryFile(
 )
 
 ### Header
-print('''
+header = '''
 #include <stddef.h>
 
 #include "bio-types.h"
-''')
+'''
+print(header)
+stats.count('bytes_written', len(header) + 1)
 
 ### Jump table writing
+# By default, each context's lookup function is a switch over message offsets. As offsets are
+# allocated densely from `BUILTIN_MESSAGE_BASE`, `--dense` instead emits an array per context indexed
+# by `name_offset - BUILTIN_MESSAGE_BASE`, making lookup a bounds check and a load.
 context_results = {}
+context_funcs = {}
 
-for context in contexts:
-	context_results[context] = f'BareioBuiltinMessageFunc* _bareio_builtin_{context}_lookup(ptrdiff_t name_offset) {{\n'
-	context_results[context] += '\tswitch (name_offset) {\n'
+BUILTIN_MESSAGE_BASE = target.for_word_size(args.word_size).word_min
 
-BUILTIN_MESSAGE_BASE = target.WORD_MIN
-
-for i, message in enumerate(message_contexts.items()):
-	message_name, contexts = message
-
-	lock_file_out.write(f'{message_name}\n')
-
-	message_offset = BUILTIN_MESSAGE_BASE + i
+# We have to encode message codes oddly, because -WORD_MIN is parsed as -(WORD_MIN), and WORD_MIN is
+# out of range for signed ints.
+def _offset_literal(offset):
+	return f'{offset + 1} -1'
 
+with stats.phase('emit'):
 	for context in contexts:
-		func_name = func_disallowed_chars_pattern.sub('_', f'bareio_builtin_{context}_{message_name}')
-
-		context_results[context] = f'extern BareioBuiltinMessageFunc {func_name};\n' + context_results[context]
-
-		# We have to encode the message code oddly, because -WORD_MIN is parsed as -(WORD_MIN), and
-		# WORD_MIN is out of range for signed ints.
-		context_results[context] += f'\t\tcase {message_offset + 1} -1: return {func_name};\n'
-
-for context, context_output in context_results.items():
-	context_results[context] += '\t}\n'
-	context_results[context] += '\n'
-	context_results[context] += '\treturn 0;\n'
-	context_results[context] += '}\n'
-
-	print(context_results[context])
+		context_funcs[context] = {}
+
+		if args.dense:
+			context_results[context] = ''
+		else:
+			context_results[context] = f'BareioBuiltinMessageFunc* {builtins.lookup_name(context)}(ptrdiff_t name_offset) {{\n'
+			context_results[context] += '\tswitch (name_offset) {\n'
+
+	for i, message in enumerate(message_contexts.items()):
+		message_name, contexts = message
+
+		lock_file_out.write(f'{message_name}\n')
+
+		message_offset = BUILTIN_MESSAGE_BASE + i
+
+		for context in contexts:
+			# Unreachable messages keep their offset, but get no entry, so nothing references their
+			# functions and the linker can drop them.
+			if reachable is not None and message_name not in reachable.get(context, ()):
+				continue
+
+			func_name = builtins.func_name(context, message_name)
+
+			context_results[context] = f'extern BareioBuiltinMessageFunc {func_name};\n' + context_results[context]
+			context_funcs[context][i] = func_name
+
+			if not args.dense:
+				context_results[context] += f'\t\tcase {_offset_literal(message_offset)}: return {func_name};\n'
+
+	for context, context_output in context_results.items():
+		if args.dense and not context_funcs[context]:
+			# C has no empty arrays.
+			context_results[context] += f'BareioBuiltinMessageFunc* {builtins.lookup_name(context)}(ptrdiff_t name_offset) {{\n'
+			context_results[context] += '\treturn 0;\n'
+			context_results[context] += '}\n'
+		elif args.dense:
+			table_name = f'_bareio_builtin_{context}_table'
+			context_results[context] += f'\nstatic BareioBuiltinMessageFunc* const {table_name}[] = {{\n'
+
+			for index, func_name in sorted(context_funcs[context].items()):
+				context_results[context] += f'\t[{index}] = {func_name},\n'
+
+			context_results[context] += '};\n'
+			context_results[context] += '\n'
+			context_results[context] += f'BareioBuiltinMessageFunc* {builtins.lookup_name(context)}(ptrdiff_t name_offset) {{\n'
+			# Unsigned arithmetic, so offsets below the base wrap around and fail the bounds check.
+			context_results[context] += f'\tsize_t index = (size_t) name_offset - (size_t) ({_offset_literal(BUILTIN_MESSAGE_BASE)});\n'
+			context_results[context] += '\n'
+			context_results[context] += f'\tif (index >= sizeof({table_name}) / sizeof({table_name}[0])) return 0;\n'
+			context_results[context] += '\n'
+			context_results[context] += f'\treturn {table_name}[index];\n'
+			context_results[context] += '}\n'
+		else:
+			context_results[context] += '\t}\n'
+			context_results[context] += '\n'
+			context_results[context] += '\treturn 0;\n'
+			context_results[context] += '}\n'
+
+		print(context_results[context])
+		stats.count('bytes_written', len(context_results[context].encode('utf-8')) + 1)
+
+if args.contexts_out:
+	context_messages = {}
+
+	for message_name, implementing_contexts in message_contexts.items():
+		for context in implementing_contexts:
+			context_messages.setdefault(context, set()).add(message_name)
+
+	with open(args.contexts_out, 'w', encoding = 'utf-8') as f:
+		builtins.write_contexts(f, context_messages)
+
+lock_file_out.close()
 
 try:
 	os.rename(lock_file_out.name, lock_file_name)
 except OSError:
 	os.unlink(lock_file_out.name)
+
+stats.finish()
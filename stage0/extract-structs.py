@@ -6,15 +6,20 @@
 # * Padding
 # * Unions with variable-width elements
 
+import argparse
 from dataclasses import dataclass, field as dataclass_field
+import functools
+import hashlib
+import io
 import keyword
 import os
-import subprocess
 import re
 import sys
 from typing import Any, List, Set
 
-from bareio import llvm_dwarfdump, target, utils
+from bareio import llvm_dwarfdump, stats, target, utils
+from bareio.cache import file_digest
+from bareio.llvm_dwarfdump.cache import StructCache
 
 @dataclass
 class Generator:
@@ -42,31 +47,83 @@ class StructGenerator(ContainerGenerator):
 	def compile(self):
 		return (
 f'''class {self.sanitized_name}:
+	__slots__ = ({self.compile_slots()})
+
 	def __init__(self, *, {self.compile_arguments()}):
 		self.label = _get_label(f"{self.name}")
 {self.compile_initializers(2)}
 
 	def __repr__(self):
-		return f'{self.name}({{vars(self)}})'
+		return f'{self.name}({{_fields(self)}})'
 	
-	def compile(self):
-		print(f'{{self.label}}:')
-
+	def compile(self, out):
 {self.compile_compilers(2)}
 '''
 		)
 
+	def compile_slots(self):
+		return ', '.join(repr(slot) for slot in ['label', *self.slots()])
+
+	def slots(self):
+		return [slot for child in self.children for slot in child.slots()]
+
 	def compile_arguments(self):
 		return ', '.join(child.compile_arguments() for child in self.children)
 
 	def compile_compilers(self, indent):
-		return '\n\n'.join(child.compile_compilers(indent) for child in self.children)
+		# Consecutive members emitted as words of the same width go out in a single `words` call, the
+		# first one together with the struct's label.
+		statements = []
+		label = 'self.label'
+		width = None
+		values = []
+
+		def flush():
+			nonlocal label
+
+			if not values:
+				if label:
+					statements.append('\t' * indent + f'out.label({label})')
+			elif len(values) == 1 and values[0].startswith('*'):
+				statements.append('\t' * indent + f'out.words({width}, {values[0][1:]}{label_arg(label)})')
+			else:
+				statements.append('\t' * indent + f'out.words({width}, ({", ".join(values)}{"," if len(values) == 1 else ""}){label_arg(label)})')
+
+			label = None
+			values.clear()
+
+		def label_arg(label):
+			return f', {label}' if label else ''
+
+		for child in self.children:
+			child_values = child.compile_words()
+
+			if child_values is None:
+				flush()
+				statements.append(child.compile_compilers(indent))
+				continue
+
+			if values and child.width != width:
+				flush()
+
+			width = child.width
+			values += child_values
+
+		flush()
+
+		return '\n\n'.join(statements)
 
 @dataclass
 class UnionGenerator(ContainerGenerator):
+	def slots(self):
+		return [slot for child in self.children for slot in child.slots()]
+
 	def compile_arguments(self):
 		return ', '.join(f'{self.sanitize(child.name)} = None' for child in self.children)
 
+	def compile_words(self):
+		return None
+
 	def compile_compilers(self, indent):
 		return '\n'.join(
 			'\t' * indent + f'''{'el' if i > 0 else ''}if self.{self.sanitize(child.name)} is not None:
@@ -79,18 +136,31 @@ class UnionGenerator(ContainerGenerator):
 class DataGenerator(Generator):
 	name: str
 
+	def slots(self):
+		return [self.sanitized_name]
+
 	def compile_arguments(self):
 		return self.sanitized_name
 
 	def compile_initializers(self, indent):
 		return '\t' * indent + f'self.{self.sanitized_name} = {self.sanitized_name}'
 
+	def compile_words(self):
+		"""
+		Returns the expressions for the words this member is emitted as, for a `words` call, or None if
+		it is emitted otherwise. A starred expression stands for any number of words.
+		"""
+		return None
+
 @dataclass
 class NumGenerator(DataGenerator):
 	width: int
 
+	def compile_words(self):
+		return [f'''self.{self.sanitized_name}''']
+
 	def compile_compilers(self, indent):
-		return '\t' * indent + f'''print(f'.{self.width}byte {{self.{self.sanitized_name}}}')'''
+		return '\t' * indent + f'''out.word({self.width}, self.{self.sanitized_name})'''
 
 @dataclass
 class PointerGenerator(DataGenerator):
@@ -99,42 +169,190 @@ class PointerGenerator(DataGenerator):
 	def compile_arguments(self):
 		return f'''{self.sanitized_name} = 0'''
 
+	def compile_words(self):
+		return [f'''getattr(self.{self.sanitized_name}, "label", self.{self.sanitized_name})''']
+
 	def compile_compilers(self, indent):
-		return '\t' * indent + f'''print(f'.{self.width}byte {{getattr(self.{self.sanitized_name}, "label", self.{self.sanitized_name})}}')'''
+		return '\t' * indent + f'''out.word({self.width}, getattr(self.{self.sanitized_name}, "label", self.{self.sanitized_name}))'''
 
 @dataclass
 class StringGenerator(DataGenerator):
+	align: int
+
 	def compile_compilers(self, indent):
 		return (
-			'\t' * indent + f'''print('.ascii "' + _escape_str(self.{self.sanitized_name}) + '"')\n''' +
-			'\t' * indent + f'''print('.align {target.WORD_SIZE}')'''
+			'\t' * indent + f'''out.string(self.{self.sanitized_name})\n''' +
+			'\t' * indent + f'''out.align({self.align})'''
 		)
 
 @dataclass
 class PointerListGenerator(DataGenerator):
 	width: int
 
-	def compile_compilers(self, indent):
-		return (
-			'\t' * indent + f'''for elem in self.{self.sanitized_name}:\n''' +
-			'\t' * (indent + 1) + f'''print(f'.{self.width}byte {{getattr(elem, "label", elem)}}')'''
-		)
+	def compile_words(self):
+		return [f'''*[getattr(elem, "label", elem) for elem in self.{self.sanitized_name}]''']
 
 @dataclass
 class DataListGenerator(DataGenerator):
 	def compile_compilers(self, indent):
-		value_expr = f''''''
-
 		return (
 			'\t' * indent + f'''for elem in self.{self.sanitized_name}:\n''' +
-			'\t' * (indent + 1) + f'''elem.compile()'''
+			'\t' * (indent + 1) + f'''elem.compile(out)'''
 		)
 
 struct_def_start_pattern = re.compile(r'^(?:typedef )?struct(?: (\S+))? \{')
 struct_def_end_pattern = re.compile(r'^\}(?: (\S+))?;')
 width_pattern = re.compile(r'\/\*\s*\d+\s*(\d+)\s*\*\/\s*$')
 
+arg_parser = argparse.ArgumentParser(description = 'Generate Python struct classes from C debug info.')
+arg_parser.add_argument('objects', nargs = '+', metavar = 'OBJECT')
+arg_parser.add_argument(
+	'--dwarfdump',
+	action = 'store_true',
+	help = 'parse the text output of llvm-dwarfdump instead of reading the objects directly',
+)
+arg_parser.add_argument(
+	'--compact-dies',
+	action = 'store_true',
+	help = 'with --dwarfdump, keep the parsed DIEs in compact columns, using less memory but more time',
+)
+arg_parser.add_argument(
+	'-j', '--jobs',
+	type = int,
+	default = 1,
+	help = 'number of objects to process in parallel (0 for one per CPU)',
+)
+arg_parser.add_argument(
+	'--root',
+	action = 'append',
+	metavar = 'NAME',
+	help = 'only generate struct NAME and the structs it refers to, directly or through pointers, '
+		'arrays, typedefs and unions (may be repeated; default: every struct)',
+)
+arg_parser.add_argument(
+	'--cache-dir',
+	help = 'reuse struct layouts collected from unchanged objects, cached in this directory',
+)
+arg_parser.add_argument(
+	'--cache-max-size',
+	type = int,
+	default = 64 * 1024 * 1024,
+	help = 'maximum size of the struct layout cache in bytes',
+)
+arg_parser.add_argument(
+	'--cache-stats',
+	action = 'store_true',
+	help = 'report struct layout cache hits and misses on stderr',
+)
+arg_parser.add_argument(
+	'--word-size',
+	type = int,
+	choices = target.WORD_SIZES,
+	help = 'fail unless the objects were compiled for words of this many bytes (the word size is '
+		'otherwise taken from their debugging info)',
+)
+arg_parser.add_argument(
+	'-o', '--output',
+	metavar = 'FILE',
+	help = 'write the struct classes to FILE rather than stdout, leaving it untouched if unchanged',
+)
+arg_parser.add_argument(
+	'--stamp',
+	metavar = 'FILE',
+	help = 'write a fingerprint of the struct layouts to FILE, only when it changes, for the build to '
+		'depend on; with --output, nothing is generated while the fingerprint in FILE still matches',
+)
+stats.add_option(arg_parser)
+args = arg_parser.parse_args()
+
+stats.start('extract-structs.py', args.stats)
+
+## Collection
+if args.dwarfdump:
+	collect = functools.partial(llvm_dwarfdump.collect_structs_from_dwarfdump, compact = args.compact_dies)
+else:
+	collect = llvm_dwarfdump.collect_structs_from_objects
+
+cache = StructCache(args.cache_dir, args.cache_max_size) if args.cache_dir else None
+
+try:
+	if cache is None and (args.jobs == 1 or len(args.objects) == 1):
+		structs = collect(args.objects, args.root)
+	else:
+		structs = llvm_dwarfdump.collect_structs_per_object(args.objects, collect, args.jobs or None, cache, args.root)
+except llvm_dwarfdump.LayoutConflictError as e:
+	print(e, file = sys.stderr)
+	sys.exit(1)
+
+missing_roots = set(args.root or ()) - structs.keys()
+
+if missing_roots:
+	print(f'root structs not found: {", ".join(sorted(missing_roots))}', file = sys.stderr)
+	sys.exit(1)
+
+if cache is not None and args.cache_stats:
+	print(cache.stats(), file = sys.stderr)
+
+### Target
+# The structs' address size is the target's word size.
+word_sizes = {struct.addr_size for struct in structs.values()}
+
+if len(word_sizes) > 1:
+	print(f'objects compiled for different address sizes: {", ".join(map(str, sorted(word_sizes)))}', file = sys.stderr)
+	sys.exit(1)
+
+word_size = word_sizes.pop() if word_sizes else args.word_size or target.DEFAULT_WORD_SIZE
+
+if args.word_size is not None and word_size != args.word_size:
+	print(f'objects compiled for {word_size}-byte addresses, not {args.word_size}', file = sys.stderr)
+	sys.exit(1)
+
+try:
+	word_target = target.for_word_size(word_size)
+except ValueError as e:
+	print(e, file = sys.stderr)
+	sys.exit(1)
+
+### Fingerprint
+# Function body edits leave the layouts alone, and so the generated classes too. The fingerprint
+# covers the collected layouts, the word size, and the sources that shape the classes generated from
+# them: this generator, the target parameters and the tree walker.
+GENERATOR_SOURCES = (__file__, target.__file__, utils.__file__)
+
+def layout_fingerprint(structs):
+	digest = hashlib.sha256(f'word_size={word_target.word_size}:'.encode('utf-8'))
+
+	for path in GENERATOR_SOURCES:
+		file_digest(path, digest)
+
+	# What the structs refer to only decides which are collected, and a set's repr is in no fixed order.
+	digest.update(repr([struct._replace(references = None) for struct in structs.values()]).encode('utf-8'))
+
+	return digest.hexdigest()
+
+with stats.phase('fingerprint'):
+	fingerprint = layout_fingerprint(structs)
+
+stats.count('structs', len(structs))
+
+if args.stamp and args.output and os.path.exists(args.output):
+	try:
+		with open(args.stamp, encoding = 'utf-8') as f:
+			unchanged = f.read().strip() == fingerprint
+	except OSError:
+		unchanged = False
+
+	if unchanged:
+		stats.count('unchanged')
+		stats.finish()
+		sys.exit(0)
+
+## Generation
+out = io.StringIO() if args.output else sys.stdout
+
 print(f'''
+WORD_SIZE = {word_target.word_size}
+
 def _get_label(prefix):
 	result = _get_label.next
 	_get_label.next += 1
@@ -143,21 +361,10 @@ def _get_label(prefix):
 
 _get_label.next = 0
 
-def _escape_str(s):
-	return s.encode('utf-8').decode('latin-1').encode('unicode_escape').decode('latin-1')
-
-''')
-
+def _fields(o):
+	return {{slot: getattr(o, slot) for slot in o.__slots__}}
 
-structs = llvm_dwarfdump.collect_structs(
-	subprocess.run(
-		['llvm-dwarfdump', '--debug-info'] + sys.argv[1:],
-		check=True,
-
-		stdout=subprocess.PIPE,
-		text=True,
-	).stdout
-)
+''', file = out)
 
 def _generate_struct(walker, struct):
 	return StructGenerator(
@@ -185,7 +392,8 @@ def _generate_flexible_struct_array(walker, value):
 def _generate_flexible_value_array(walker, value):
 	if value.type == 'char':
 		return StringGenerator(
-			name = value.name
+			name = value.name,
+			align = word_target.word_align,
 		)
 	else:
 		raise RuntimeError(f'unhandled flexible array type: {value.type}')
@@ -201,15 +409,31 @@ def _generate_union(walker, union):
 		children = list([x for x in walker.walk_all(union.children) if x]),
 	)
 
+generator_walker = utils.walker({
+	llvm_dwarfdump.DwarfStruct: _generate_struct,
+	llvm_dwarfdump.DwarfMemberValue: _generate_value,
+	llvm_dwarfdump.DwarfMemberPointer: _generate_pointer,
+	llvm_dwarfdump.DwarfMemberFlexibleStructArray: _generate_flexible_struct_array,
+	llvm_dwarfdump.DwarfMemberFlexibleValueArray: _generate_flexible_value_array,
+	llvm_dwarfdump.DwarfMemberFlexiblePointerArray: _generate_flexible_pointer_array,
+	llvm_dwarfdump.DwarfMemberUnion: _generate_union,
+})
+
 for struct in structs.values():
-	print(
-		utils.walker({
-			llvm_dwarfdump.DwarfStruct: _generate_struct,
-			llvm_dwarfdump.DwarfMemberValue: _generate_value,
-			llvm_dwarfdump.DwarfMemberPointer: _generate_pointer,
-			llvm_dwarfdump.DwarfMemberFlexibleStructArray: _generate_flexible_struct_array,
-			llvm_dwarfdump.DwarfMemberFlexibleValueArray: _generate_flexible_value_array,
-			llvm_dwarfdump.DwarfMemberFlexiblePointerArray: _generate_flexible_pointer_array,
-			llvm_dwarfdump.DwarfMemberUnion: _generate_union,
-		}).walk(struct).compile()
-	)
+	with stats.phase('walk'):
+		generator = generator_walker.walk(struct)
+
+	with stats.phase('emit'):
+		text = generator.compile()
+		print(text, file = out)
+
+	stats.count('bytes_written', len(text.encode('utf-8')) + 1)
+
+if args.output:
+	with stats.phase('emit'):
+		utils.replace_file(args.output, out.getvalue())
+
+if args.stamp:
+	utils.replace_file(args.stamp, fingerprint + '\n')
+
+stats.finish()
@@ -0,0 +1,64 @@
+## Profile report
+# Maps the message counts dumped by a profiling build (configured with `-DBAREIO_PROFILE=ON`) back to
+# the builtin scripts, using the profile map written by `compiler.py --profile`.
+#
+# Capture the serial output of a run, for instance with `make qemu-nogdb | tee serial.log`, then:
+#
+# Usage: profile-report.py MAP LOG [--by message|line] [--top N]
+
+import argparse
+import sys
+
+from bareio import profile
+
+arg_parser = argparse.ArgumentParser(description = 'Report how often each builtin script message ran.')
+arg_parser.add_argument('map', metavar = 'MAP', help = 'profile map from compiler.py --profile')
+arg_parser.add_argument('log', metavar = 'LOG', help = 'captured serial output containing a profile dump')
+arg_parser.add_argument(
+	'--by',
+	choices = ['message', 'line'],
+	default = 'message',
+	help = 'report each message, or total the messages on each source line',
+)
+arg_parser.add_argument('--top', type = int, help = 'only report the N most frequent')
+args = arg_parser.parse_args()
+
+with open(args.map, encoding = 'utf-8') as f:
+	messages = profile.read_map(f)
+
+with open(args.log, encoding = 'utf-8', errors = 'replace') as f:
+	log = f.read()
+
+try:
+	message_count, counts = profile.parse_log(log)
+
+	if message_count != len(messages):
+		raise profile.ProfileError(
+			f'the dump has {message_count} messages but the map {len(messages)}; was the map written '
+			'for this build?'
+		)
+except profile.ProfileError as e:
+	print(f'{args.log}: {e}', file = sys.stderr)
+	sys.exit(1)
+
+rows = {}
+
+for index, count in counts.items():
+	message = messages[index]
+	location = f'{message["source"]}:{message["line"]}'
+
+	if args.by == 'message':
+		key = (f'{location}:{message["column"]}', message['message'])
+	else:
+		key = (location, '')
+
+	rows[key] = rows.get(key, 0) + count
+
+total = sum(rows.values())
+report = sorted(rows.items(), key = lambda row: -row[1])
+
+if args.top is not None:
+	report = report[:args.top]
+
+for (location, description), count in report:
+	print(f'{count:12} {count / total * 100:6.2f}%  {location:30} {description}')
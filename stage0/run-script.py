@@ -0,0 +1,105 @@
+## Script runner
+# Runs builtin .io scripts on the host with the reference interpreter (see `bareio/interpreter.py`),
+# printing their output to stdout, as the kernel would over the UART.
+#
+# Usage: run-script.py [SOURCE ...] [--object OBJECT] [--check] [--timings] [--top N]
+#
+# SOURCEs are run as if concatenated (by default, a single script on stdin). With `--object`, the
+# script in an object from `compiler.py --format elf` is run instead, or, with `--check`, as well,
+# and the outputs compared: a difference means the compiler changed what the script does.
+
+import argparse
+import io
+import sys
+
+from bareio import interpreter, parser
+
+arg_parser = argparse.ArgumentParser(description = 'Run builtin .io scripts on the host.')
+arg_parser.add_argument(
+	'sources',
+	nargs = '*',
+	metavar = 'SOURCE',
+	help = 'scripts to run, in order, as if concatenated (default: a single script on stdin)',
+)
+arg_parser.add_argument(
+	'--object',
+	metavar = 'OBJECT',
+	help = 'run the script compiled into OBJECT (by compiler.py --format elf) instead of the sources',
+)
+arg_parser.add_argument(
+	'--check',
+	action = 'store_true',
+	help = 'run both the sources and --object, and fail if their output differs',
+)
+arg_parser.add_argument(
+	'--lock-file',
+	default = 'src/method-names.lock',
+	help = 'message name lock file OBJECT was compiled with',
+)
+arg_parser.add_argument(
+	'--timings',
+	action = 'store_true',
+	help = 'report the time spent in each message on stderr',
+)
+arg_parser.add_argument('--top', type = int, help = 'only report the N slowest messages')
+args = arg_parser.parse_args()
+
+if args.check and not args.object:
+	arg_parser.error('--check requires --object')
+
+def source_messages():
+	if not args.sources:
+		text = sys.stdin.read()
+
+		return interpreter.from_ast(parser.parse(text), '<stdin>', text)
+
+	messages = []
+
+	for path in args.sources:
+		with open(path, encoding = 'utf-8') as f:
+			text = f.read()
+
+		messages += interpreter.from_ast(parser.parse(text), path, text)
+
+	return messages
+
+def run(messages, out):
+	runner = interpreter.Interpreter(out, timed = args.timings)
+
+	try:
+		runner.run(messages)
+	except interpreter.InterpreterError as e:
+		out.flush()
+		print(f'error: {e}', file = sys.stderr)
+		sys.exit(1)
+
+	if args.timings:
+		for line in interpreter.report_timings(runner.timings, args.top):
+			print(line, file = sys.stderr)
+
+try:
+	object_messages = interpreter.from_object(args.object, args.lock_file) if args.object else None
+except interpreter.InterpreterError as e:
+	print(e, file = sys.stderr)
+	sys.exit(1)
+
+if not args.check:
+	run(object_messages if args.object else source_messages(), sys.stdout.buffer)
+	sys.exit(0)
+
+expected = io.BytesIO()
+run(source_messages(), expected)
+actual = io.BytesIO()
+run(object_messages, actual)
+
+sys.stdout.buffer.write(actual.getvalue())
+
+if actual.getvalue() != expected.getvalue():
+	expected_lines = expected.getvalue().splitlines()
+	actual_lines = actual.getvalue().splitlines()
+	line = next(
+		(i for i, (a, b) in enumerate(zip(expected_lines, actual_lines)) if a != b),
+		min(len(expected_lines), len(actual_lines)),
+	)
+	print(f'{args.object}: output differs from the sources from line {line + 1}', file = sys.stderr)
+	sys.exit(1)
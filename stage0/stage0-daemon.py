@@ -0,0 +1,42 @@
+## Stage0 daemon
+# Keeps the stage0 scripts warm between builds; see `bareio/daemon.py`. Build steps reach it through
+# `stage0-run.py`, and run directly whenever it is not running.
+#
+# Usage: stage0-daemon.py SOCKET [--idle-timeout SECONDS]
+
+import argparse
+import signal
+import sys
+
+from bareio import daemon
+
+# Import what the scripts use up front: requests run in forked processes, which start with these.
+from bareio import builtins, emit, llvm_dwarfdump, parser, profile, target, utils
+
+arg_parser = argparse.ArgumentParser(description = 'Serve stage0 script runs over a Unix socket.')
+arg_parser.add_argument('socket', metavar = 'SOCKET', help = 'path of the Unix socket to listen on')
+arg_parser.add_argument(
+	'--idle-timeout',
+	type = float,
+	metavar = 'SECONDS',
+	help = 'exit after this long without requests (default: never)',
+)
+args = arg_parser.parse_args()
+
+try:
+	server = daemon.Server(args.socket, args.idle_timeout)
+except (daemon.DaemonError, OSError) as e:
+	print(e, file = sys.stderr)
+	sys.exit(1)
+
+print(f'listening on {args.socket}', file = sys.stderr)
+
+# Stop cleanly, removing the socket, when terminated too.
+signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+try:
+	server.serve()
+except KeyboardInterrupt:
+	pass
+
+print(f'served {server.requests} requests', file = sys.stderr)
@@ -0,0 +1,89 @@
+## Stage0 runner
+# Runs a stage0 script in the daemon listening on SOCKET (see `stage0-daemon.py`), or directly with
+# this interpreter if there is none, or it declines. The script sees the same arguments, working
+# directory, environment and standard streams either way.
+#
+# Usage: stage0-run.py [--socket SOCKET] SCRIPT [ARGUMENT ...]
+#
+# SOCKET defaults to $BAREIO_DAEMON_SOCKET; without either, the script is run directly.
+#
+# This starts for every build step, so it speaks the daemon's protocol (see `bareio/daemon.py`)
+# itself rather than importing `bareio`, and uses `_socket`, as importing `socket` (for its enums and
+# `send_fds`) alone takes longer than starting the interpreter.
+
+import _socket
+import os
+import sys
+
+PROTOCOL_VERSION = 2
+
+def _request(socket_path, script, arguments):
+	"""
+	Runs `script` with `arguments` in the daemon listening on `socket_path`, connected to this
+	process's standard streams. Returns the script's exit status, or None if there is no daemon, or it
+	asks for the script to be run directly.
+	"""
+	fields = [str(PROTOCOL_VERSION), os.path.abspath(script), os.getcwd(), str(len(arguments)), *arguments]
+	request = b''.join(os.fsencode(field) + b'\0' for field in fields)
+	request += b''.join(name + b'=' + value + b'\0' for name, value in os.environb.items())
+
+	# Standard streams, as the C ints of an SCM_RIGHTS message.
+	fds = b''.join(fd.to_bytes(4, sys.byteorder) for fd in (0, 1, 2))
+	client = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+
+	try:
+		# The script only starts once the whole request is received, so until then it can still be run
+		# directly.
+		try:
+			client.connect(socket_path)
+			sent = client.sendmsg([request], [(_socket.SOL_SOCKET, _socket.SCM_RIGHTS, fds)])
+			client.sendall(request[sent:])
+			client.shutdown(_socket.SHUT_WR)
+		except OSError:
+			return None
+
+		reply = b''
+
+		try:
+			while True:
+				chunk = client.recv(4096)
+
+				if not chunk:
+					break
+
+				reply += chunk
+		except OSError:
+			pass
+	finally:
+		client.close()
+
+	if reply.startswith(b'status '):
+		return int(reply[len(b'status '):])
+	elif reply.startswith(b'fallback '):
+		return None
+
+	print(f'{script}: the daemon exited without replying', file = sys.stderr)
+	sys.exit(1)
+
+arguments = sys.argv[1:]
+socket_path = os.environ.get('BAREIO_DAEMON_SOCKET')
+
+if arguments[:1] == ['--socket'] and len(arguments) >= 2:
+	socket_path = arguments[1]
+	arguments = arguments[2:]
+
+if not arguments:
+	print('usage: stage0-run.py [--socket SOCKET] SCRIPT [ARGUMENT ...]', file = sys.stderr)
+	sys.exit(2)
+
+script, arguments = arguments[0], arguments[1:]
+status = None
+
+if socket_path:
+	status = _request(socket_path, script, arguments)
+
+if status is None:
+	sys.stdout.flush()
+	os.execv(sys.executable, [sys.executable, script, *arguments])
+
+sys.exit(status)